@@ -35,7 +35,7 @@ from multiprocessing import Queue
 
 import requests
 from requests.exceptions import InvalidURL
-from lxml.html import fromstring, tostring
+from lxml.html import fromstring, tostring, HTMLParser
 from lxml import etree
 
 # Python std lib imports
@@ -49,10 +49,26 @@ import platform
 import json
 import traceback
 import base64
-from shutil import rmtree
-from time import sleep
+import hashlib
+import sqlite3
+import atexit
+import threading
+import queue
+import asyncio
+import tempfile
+import io
+import zipfile
+import tarfile
+import http.client
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from types import SimpleNamespace
+from functools import lru_cache
+from shutil import rmtree, copyfile
+from time import sleep, monotonic, time
 import getpass
-from urllib.parse import urlparse
+import random
+from urllib.parse import urlparse, parse_qs
 # Requires Python 3.4
 from pathlib import Path
 
@@ -63,11 +79,15 @@ parser = argparse.ArgumentParser(description='Download files from itslearning. C
 parser.add_argument('--output-dir', '-O', dest='output_dir', default=None,
 					help='Defines the directory to output files from. If left empty, the program will prompt.')
 parser.add_argument('--rate-limit-delay', '-R', dest='rate_limit', type=float, default=1,
-					help="Rate limits requests to It's Learning (seconds). Defaults to 1 second.")
+					help="Rate limits requests to It's Learning (seconds between requests). Defaults to 1 second. Ignored if --requests-per-second is set.")
+parser.add_argument('--requests-per-second', dest='requests_per_second', type=float, default=None,
+					help="Maximum average number of requests per second sent to It's Learning, shared by all workers. Set to 0 to disable rate limiting.")
+parser.add_argument('--burst', dest='burst', type=int, default=1,
+					help='Number of requests which may be sent in quick succession after a quiet period, before the rate limit kicks in. Defaults to 1.')
 parser.add_argument('--skip-to-course', '-S', dest='skip_to_course', type=int, default=0,
 					help='Skip to a course with a specific index. Useful after a crash. Set to 1 to only skip downloading internal messages.')
 parser.add_argument('--enable-checkpoints', '-C', dest='enable_checkpoints', type=bool, default=False, 
-					help='Save the location of the last element encountered by the dumping process. Useful for quick recovery while debugging, or being able to continue the dumping process at a later date.')
+					help='Keep track of which items have been dumped. Useful for quick recovery while debugging, or being able to continue the dumping process at a later date.')
 parser.add_argument('--output-text-extension', '-E', dest='output_extension', default='.html',
 					help='Specifies the extension given to produced plaintext files. Values ought to be either ".html" or ".txt".')
 parser.add_argument('--list', '-L', dest='do_listing', action='store_true',
@@ -78,19 +98,92 @@ parser.add_argument('--courses-only', '-F', dest='courses_only', action='store_t
 					help='Only dump courses. No internal messages or projects are saved.')
 parser.add_argument('--messages-only', '-M', dest='messaging_only', action='store_true',
 					help='Only dump internal messages. No courses or projects are saved.')
+parser.add_argument('--deduplicate', dest='deduplicate', action='store_true',
+					help='Store each distinct downloaded file only once, and link the copies in the course folders to it.')
+parser.add_argument('--incremental', '-I', dest='incremental', action='store_true',
+					help='Update a previous dump in the output directory, only downloading items which are new or have changed since.')
+parser.add_argument('--http-cache', dest='http_cache', action='store_true',
+					help='Keep a copy of every page downloaded, and only download pages again if they have changed (provided the server tells us so).')
+parser.add_argument('--http-cache-dir', dest='http_cache_dir', default=None,
+					help='Directory where the cache of downloaded pages is stored. Defaults to a directory named .http-cache in the output directory.')
+parser.add_argument('--offline', dest='offline', action='store_true',
+					help='Don\'t connect to It\'s Learning at all, and instead replay the pages saved in the cache of an earlier run (see --http-cache). Files are not downloaded in this mode.')
+parser.add_argument('--export', dest='export', choices=['jsonl', 'sqlite'], default=None,
+					help='Also write courses, bulletins, comments, messages, assignment submissions and test answers as structured records, to export.jsonl or export.sqlite in the output directory.')
+parser.add_argument('--pack-output', dest='pack_output', choices=['zip', 'tar'], default=None,
+					help='Instead of creating a file for every item, write the contents of every course, project and inbox to a single ZIP or tar archive.')
+parser.add_argument('--benchmark', dest='benchmark', choices=['parse', 'sanitise'], default=None,
+					help='Instead of dumping anything, measure how fast things run. \'parse\' parses the pages in the HTTP cache (see --http-cache-dir), per type of page. \'sanitise\' cleans up a set of typical file paths and names.')
 parser.add_argument('--recreate-dump-dir', '-D', dest='recreate_out_dir', action='store_true',
 					help='Delete the output directory and recreate it (useful for debugging)')
 parser.add_argument('--username', '-U', dest='username', default=None,
 					help='Specify a username to be dumped')
 parser.add_argument('--password', '-Q', dest='password', default=None,
 					help='Specify a password of the user to be dumped')
+parser.add_argument('--workers', '-W', dest='workers', type=int, default=1,
+					help='Number of courses and projects which are dumped simultaneously. Defaults to 1.')
+parser.add_argument('--max-requests-in-flight', dest='max_requests_in_flight', type=int, default=None,
+					help='Upper limit on the number of requests sent to It\'s Learning at the same time, shared by all workers. Defaults to the number of workers, or 64 when using the asyncio engine.')
+parser.add_argument('--engine', dest='engine', choices=['threads', 'asyncio'], default='threads',
+					help='Selects how courses are downloaded. The asyncio engine fetches folders and files concurrently on a single thread, and requires the aiohttp package. Defaults to threads.')
+parser.add_argument('--fetch-workers', dest='fetch_workers', type=int, default=4,
+					help='Number of pages fetched at the same time while dumping a single item, such as the threads of a discussion forum, and the number of items in the folders of a course dumped at the same time. Defaults to 4.')
+parser.add_argument('--messaging-page-size', dest='messaging_page_size', type=int, default=15,
+					help='Number of message threads requested at a time from the messaging API. Larger pages mean fewer requests. Defaults to 15, which is what It\'s Learning itself uses.')
+parser.add_argument('--write-queue-size', dest='write_queue_size', type=int, default=256,
+					help='Number of text files which may be waiting to be written to disk by the background writer. Set to 0 to write files immediately instead. Defaults to 256.')
+parser.add_argument('--pool-size', dest='pool_size', type=int, default=None,
+					help='Number of connections kept open to each server, so they can be reused by later requests. Defaults to the maximum number of requests in flight, or 10, whichever is larger.')
+parser.add_argument('--retries', dest='retries', type=int, default=5,
+					help='Number of times a request is tried again after a server error (5xx), a timeout or a dropped connection, waiting longer after every attempt. Defaults to 5.')
+parser.add_argument('--retry-backoff', dest='retry_backoff', type=float, default=1,
+					help='Number of seconds waited before the first retry of a failed request. Doubles with every further attempt, up to a minute. Defaults to 1.')
+parser.add_argument('--retry-failed', dest='retry_failed', action='store_true',
+					help='Instead of dumping everything, try the items which failed during an earlier run into the same output directory once more. These are listed in failed_items.jsonl.')
+parser.add_argument('--http2', dest='http2', action='store_true',
+					help='Use HTTP/2 where the server supports it, so all requests to a server share a single connection. Requires the httpx package with HTTP/2 support.')
 
 args = parser.parse_args()
 
-# I've sprinkled delays around the code to ensure the script isn't spamming requests at maximum rate.
-# Each time such a delay occurs, it waits for this many seconds.
-# Feel free to increase this if you plan to run this script overnight.
-rate_limiting_delay_seconds = args.rate_limit
+# All requests are scheduled centrally, to ensure the script isn't spamming requests at maximum rate.
+# The default of one request per second corresponds to the old delay of one second after each request.
+# Feel free to lower this if you plan to run this script overnight.
+if args.requests_per_second is not None:
+	requests_per_second = args.requests_per_second
+elif args.rate_limit > 0:
+	requests_per_second = 1 / args.rate_limit
+else:
+	requests_per_second = 0
+
+# Courses and projects can be dumped by a number of workers in parallel.
+# All of them share a single budget of requests which may be underway at the same time,
+# so adding workers speeds things up without hammering the servers.
+worker_count = max(1, args.workers)
+max_requests_in_flight = max(1, args.max_requests_in_flight if args.max_requests_in_flight is not None else worker_count)
+
+# The asyncio engine multiplexes requests for folders and files on a single thread, so it can have many more of them underway.
+# Pages which rely on postbacks are still handled by a pool of `worker_count` threads.
+use_async_engine = args.engine == 'asyncio'
+async_max_requests_in_flight = max(1, args.max_requests_in_flight if args.max_requests_in_flight is not None else 64)
+if use_async_engine and args.offline:
+	print('NOTE: The asyncio engine can not replay cached pages. Falling back to the threads engine.')
+	use_async_engine = False
+if use_async_engine and args.http_cache:
+	print('NOTE: The asyncio engine does not use the HTTP cache for folder listings and files. Other pages are still cached.')
+
+# Items consisting of many pages are dumped in stages: pages are fetched by `fetch_worker_count` threads,
+# parsed by another thread, and written to disk by yet another, so the network never has to wait for the disk.
+# Each stage has a queue of limited size in front of it. When a stage falls behind, the ones before it wait for it to catch up.
+fetch_worker_count = max(1, args.fetch_workers)
+pipeline_queue_size = 16
+
+# Message threads are requested from the messaging API in pages of this size.
+# While one page is being saved, the next `fetch_worker_count` pages are already on their way.
+messaging_page_size = max(1, args.messaging_page_size)
+
+# Text files are handed over to a background writer, which writes them to disk in batches.
+write_queue_size = max(0, args.write_queue_size)
+write_batch_size = 32
 
 # Some bits and pieces of text may contain special characters. Since a number of these are used
 # in file paths and file names, they have to be filtered out. 
@@ -104,15 +197,21 @@ invalid_filename_characters = [':', '.', ',', '*', '/', '\\', '?', '"', '<', '>'
 # as the file type. You may want to change this to .txt though, since many files also contain plaintext bits.
 output_text_extension = args.output_extension
 
+# Progress of the dump is recorded in this file inside the output directory, when checkpoints are enabled.
+checkpoint_file_name = '.checkpoint.jsonl'
+
 # Use if the program crashed and stopped early. Skips to a course with a specific index
 # If this value is non-zero, also downloading of the messaging inbox will be skipped.
 # The index is 1-indexed, and corresponds to the course index listed on the print messages in the console
 # when the dumping of a new course is started.
 skip_to_course_with_index = max(args.skip_to_course, (1 if args.courses_only or args.projects_only else 0))
+# Failed items are retried regardless of where they are in the list
+if args.retry_failed:
+	skip_to_course_with_index = 0
 
 # --- INTRO ---
 
-if not args.do_listing:
+if not args.do_listing and args.benchmark is None:
 	print('----- It\'s Learning dump script -----')
 	print('Created by: Bart van Blokland (bart.van.blokland@ntnu.no)')
 	print('Modified by: Fredrik Erlandsson (fer@bth.se) with further modifications from Martin Bergström')
@@ -152,7 +251,8 @@ if not args.do_listing:
 			print('Folder selection cancelled. Aborting.')
 			sys.exit(0)
 		output_folder_name = os.path.abspath(output_folder_name)
-		is_directory_empty = not os.listdir(output_folder_name)
+		# Incremental dumps are meant to be run on top of an existing dump, and an unfinished dump can be continued
+		is_directory_empty = args.incremental or args.retry_failed or not os.listdir(output_folder_name) or os.path.exists(os.path.join(output_folder_name, checkpoint_file_name))
 		if args.recreate_out_dir and os.path.exists(output_folder_name):
 			print('Recreating output directory..')
 			rmtree(output_folder_name)
@@ -172,8 +272,8 @@ elif args.recreate_out_dir and os.path.exists(output_folder_name):
 	os.makedirs(output_folder_name)
 
 
-# If a crash occurs, the script can skip all elements in folders up to the point where it left off. 
-# The state is stored in a small text file created inside the working directory.
+# If a crash occurs, the script can skip all items it already finished up to the point where it left off.
+# The completed items are recorded in a small journal file created inside the output directory.
 # Turn this setting on to allow the creation of these checkpoints. They are only really useful if you can fix the issue causing the crash in the first place.
 enable_checkpoints = args.enable_checkpoints
 
@@ -233,7 +333,7 @@ itslearning_online_test_url = {
 itslearning_online_test_details_postback_url = {
 	'hkr': 'https://hkr.itslearning.com/Ntt/EditTool/ViewTestResults.aspx?TestResultId={}'}
 itslearning_new_messaging_api_url = {
-	'hkr': 'https://hkr.itslearning.com/restapi/personal/instantmessages/messagethreads/v1?threadPage={}&maxThreadCount=15'}
+	'hkr': 'https://hkr.itslearning.com/restapi/personal/instantmessages/messagethreads/v1?threadPage={}&maxThreadCount={}'}
 itslearning_all_projects_url = {
 	'hkr': 'https://hkr.itslearning.com/Project/AllProjects.aspx'}
 base64_png_image_url = {
@@ -246,82 +346,1070 @@ itslearning_learning_tool_custom_base_url = {
 	'hkr': 'https://hkr.itslearning.com/CustomActivity/CustomActivityOverview.aspx?CustomActivityId='}
 
 innsida_login_parameters = {'SessionExpired': 0}
-progress_file_location = os.path.join(os.getcwd(), 'saved_progress_state.txt')
+
+# Downloads are written to disk in pieces of this size, so large files never have to fit in memory.
+download_chunk_size = 1024 * 1024
+
+# Downloads in progress are kept in this directory (inside the output directory) until they are complete.
+# If one is interrupted, the next run picks up where it left off, provided the server supports it.
+# The progress is saved every time this many bytes have been written.
+partial_downloads_directory_name = '.partial'
+partial_download_save_interval = 16 * 1024 * 1024
+partial_download_locks = {}
+partial_download_locks_lock = threading.Lock()
+
+# The same file is often attached to many assignments, bulletins and posts.
+# When deduplicating, every downloaded file is stored once in this directory (inside the output directory), named after the hash of its contents.
+# The files in the course folders are hard links to it (or copies, if the file system doesn't support those).
+# The index file lists which paths belong to which stored file.
+deduplicate_files = args.deduplicate
+if deduplicate_files and args.pack_output is not None:
+	print('NOTE: Files can not be deduplicated when packing the output into archives. Files will be stored in the archives as they are.')
+	deduplicate_files = False
+blob_store_directory_name = '.blobs'
+blob_store_index_name = 'index.jsonl'
+blob_store_lock = threading.Lock()
+
+# Incremental dumps keep track of every item dumped in a small database inside the output directory.
+# Each item is stored along with a fingerprint of what it looked like at the time, so a later run can tell whether it changed.
+manifest_file_name = '.manifest.sqlite'
+manifest = None
+
+# Set when checkpoints are enabled, or when continuing from a previous checkpoint.
+checkpoint_journal = None
+
+# Items which could not be dumped are listed in this file inside the output directory, so they can be tried again with --retry-failed.
+failed_items_file_name = 'failed_items.jsonl'
+failed_items = None
+
+# Structured records of everything that is dumped can be written to this file (inside the output directory),
+# with either a .jsonl or a .sqlite extension depending on the chosen format.
+export_file_name = 'export'
+export_sink = None
+
+# When packing the output, everything belonging to one course, project or inbox ends up in a single archive, next to where its folder would have been.
+# The index file (inside the output directory) lists which entries were written to which archive.
+pack_index_name = 'pack-index.jsonl'
+packed_output = None
+
+# Pages can be cached on disk. Cached pages are revalidated with the server using If-None-Match/If-Modified-Since,
+# and in offline mode they are replayed without contacting the server at all.
+# Only pages are cached; files are downloaded straight to their destination.
+offline_mode = args.offline
+http_cache = None
+
+# Directories created and file names handed out during this run are remembered, so the file system doesn't have to be asked about them again.
+# Each directory is listed at most once; from then on, new files in it are only claimed in memory.
+created_directories = set()
+listed_directories = set()
+claimed_paths = set()
+path_registry_lock = threading.Lock()
 
 overflow_count = 0
+overflow_lock = threading.Lock()
+
+# Workers ask the user what to do when something crashes. Only one of them gets to do so at a time.
+console_lock = threading.Lock()
+
+# Shared by all sessions, limits the number of requests that are underway at any given time.
+request_slots = threading.BoundedSemaphore(max_requests_in_flight)
+
+# All sessions share one set of connections, which are kept open between requests.
+# Files are served from other hosts than pages, so connections are kept for a number of hosts at the same time.
+connection_pool_size = max(1, args.pool_size) if args.pool_size is not None else max(10, max_requests_in_flight)
+connection_pool_hosts = 32
+use_http2 = args.http2
+
+# Created at startup, mounted on every session.
+transport_adapter = None
+
+# Requests which fail in a way that is likely to go away by itself are retried a number of times, with a growing delay in between.
+# Requests which stall are given up on after `request_timeout` seconds without a response, and retried as well.
+retry_count = max(0, args.retries)
+retry_backoff = max(0, args.retry_backoff)
+retry_backoff_limit = 60
+retry_status_codes = [429, 500, 502, 503, 504]
+request_timeout = 60
+
+# Created at startup unless files should be written immediately.
+output_writer = None
+
+# Put into a queue to tell the threads reading from it to stop.
+end_of_queue = object()
+
+thread_local_state = threading.local()
 
 # --- HELPER FUNCTIONS ---
 
-def delay():
-	sleep(rate_limiting_delay_seconds)
+class TokenBucket:
+	# Hands out one token per request. Tokens trickle in at a fixed rate, and up to `burst` of them can be saved up.
+	# A request that finds the bucket empty is given a slot in the future instead, so waiting requests are served in order.
+	def __init__(self, rate, burst):
+		self.rate = rate
+		self.burst = max(1, burst)
+		self.tokens = self.burst
+		self.last_refill = monotonic()
+		self.lock = threading.Lock()
+
+	# Takes a token, and returns the number of seconds to wait before it may be used.
+	def reserve(self):
+		if self.rate <= 0:
+			return 0
+		with self.lock:
+			now = monotonic()
+			self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+			self.last_refill = now
+			self.tokens -= 1
+			if self.tokens >= 0:
+				return 0
+			return -self.tokens / self.rate
+
+	def acquire(self):
+		wait_time = self.reserve()
+		if wait_time > 0:
+			sleep(wait_time)
+
+request_bucket = TokenBucket(requests_per_second, args.burst)
+
+class CheckpointJournal:
+	# Completed items are appended to the journal in batches. A batch is written once it reaches this many items,
+	# or when this many seconds have passed since the last one. Anything lost in a crash is simply dumped again.
+	flush_interval_items = 100
+	flush_interval_seconds = 10
+
+	# A read-only journal only remembers what was completed in memory. Items of the ignored kinds are not loaded.
+	def __init__(self, path, resume, read_only=False, ignored_kinds=[]):
+		self.path = path
+		self.lock = threading.Lock()
+		self.completed_items = set()
+		self.pending_lines = []
+		self.last_flush = monotonic()
+		if resume:
+			with open(path, encoding='utf-8') as journal_file:
+				for line in journal_file:
+					try:
+						entry = json.loads(line)
+					except ValueError:
+						# The last line may have been cut off by a crash
+						continue
+					if entry['kind'] not in ignored_kinds:
+						self.completed_items.add((entry['kind'], entry['id']))
+		self.journal_file = None if read_only else open(path, 'a' if resume else 'w', encoding='utf-8')
+
+	def isCompleted(self, kind, item_id):
+		with self.lock:
+			return (kind, str(item_id)) in self.completed_items
+
+	def markCompleted(self, kind, item_id):
+		with self.lock:
+			self.completed_items.add((kind, str(item_id)))
+			self.pending_lines.append(json.dumps({'kind': kind, 'id': str(item_id)}) + '\n')
+			if len(self.pending_lines) >= self.flush_interval_items or monotonic() - self.last_flush >= self.flush_interval_seconds:
+				self.flush()
+
+	# Needs to be called while holding the lock
+	def flush(self):
+		if self.journal_file is not None:
+			self.journal_file.write(''.join(self.pending_lines))
+			self.journal_file.flush()
+			os.fsync(self.journal_file.fileno())
+		self.pending_lines = []
+		self.last_flush = monotonic()
+
+	def close(self):
+		with self.lock:
+			self.flush()
+			if self.journal_file is not None:
+				self.journal_file.close()
+
+# Both of these do nothing unless checkpoints are in use.
+def isCompleted(kind, item_id):
+	return checkpoint_journal is not None and checkpoint_journal.isCompleted(kind, item_id)
+
+# When files are written in the background, an item only counts as completed once the files it queued are on disk.
+def markCompleted(kind, item_id):
+	if checkpoint_journal is None:
+		return
+	if output_writer is not None:
+		output_writer.defer(checkpoint_journal.markCompleted, kind, item_id)
+	else:
+		checkpoint_journal.markCompleted(kind, item_id)
+
+class ExportSink:
+	# Records are written in batches of this size. In a database, each batch is a single transaction.
+	batch_size = 200
+
+	def __init__(self, path, export_format):
+		self.lock = threading.Lock()
+		self.export_format = export_format
+		self.pending_records = []
+		if export_format == 'sqlite':
+			self.connection = sqlite3.connect(path, check_same_thread=False)
+			self.connection.execute('CREATE TABLE IF NOT EXISTS records (record_id INTEGER PRIMARY KEY, type TEXT NOT NULL, key TEXT, data TEXT NOT NULL, exported TEXT NOT NULL)')
+			# Exports made before records had a key are kept; their records just can't be replaced.
+			if 'key' not in [column[1] for column in self.connection.execute('PRAGMA table_info(records)')]:
+				self.connection.execute('ALTER TABLE records ADD COLUMN key TEXT')
+			# Records are replaced when the same item is exported again, by a resumed, retried or incremental run
+			self.connection.execute('CREATE UNIQUE INDEX IF NOT EXISTS records_by_key ON records (type, key)')
+			self.connection.commit()
+		else:
+			self.export_file = open(path, 'a', encoding='utf-8')
+
+	def write(self, record_type, key, fields):
+		with self.lock:
+			self.pending_records.append((record_type, key, fields))
+			if len(self.pending_records) >= self.batch_size:
+				self.flush()
+
+	# Needs to be called while holding the lock
+	def flush(self):
+		if self.export_format == 'sqlite':
+			with self.connection:
+				self.connection.executemany("INSERT OR REPLACE INTO records (type, key, data, exported) VALUES (?, ?, ?, datetime('now'))", [(record_type, key, json.dumps(fields, ensure_ascii=False)) for record_type, key, fields in self.pending_records])
+		else:
+			self.export_file.write(''.join([json.dumps(dict(type=record_type, key=key, **fields), ensure_ascii=False) + '\n' for record_type, key, fields in self.pending_records]))
+			self.export_file.flush()
+		self.pending_records = []
+
+	def close(self):
+		with self.lock:
+			self.flush()
+			if self.export_format == 'sqlite':
+				self.connection.close()
+			else:
+				self.export_file.close()
+
+# Does nothing unless an export format was chosen.
+# The key identifies the item among records of the same type, so exporting it again replaces the earlier record.
+# Records without a key (None) are never replaced.
+def exportRecord(record_type, key, **fields):
+	if export_sink is not None:
+		export_sink.write(record_type, str(key) if key is not None else None, fields)
+
+class NotInCacheError(Exception):
+	pass
+
+# Raised when some of the versions of a file could not be downloaded, once all of them were tried.
+class DownloadFailedError(Exception):
+	pass
+
+# Raised when a file (or, in the asyncio engine, a page) is answered with something other than a success.
+class UnexpectedStatusError(Exception):
+	pass
+
+class HTTPCache:
+	def __init__(self, directory):
+		self.directory = directory
+		os.makedirs(directory, exist_ok=True)
+
+	def key(self, method, url, data):
+		# Postbacks are keyed by the form data they send. When replaying, the form was read from a cached page, so the data matches.
+		key_source = method + ' ' + url
+		if data is not None:
+			key_source += ' ' + json.dumps(sorted(data.items()) if isinstance(data, dict) else str(data))
+		return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+	def load(self, key):
+		entry_path = os.path.join(self.directory, key[0:2], key)
+		try:
+			with open(entry_path + '.json', encoding='utf-8') as entry_file:
+				entry = json.load(entry_file)
+			with open(entry_path + '.body', 'rb') as body_file:
+				body = body_file.read()
+		except (OSError, ValueError):
+			return None
+		response = requests.models.Response()
+		response.status_code = entry['status_code']
+		response.reason = entry['reason']
+		response.headers = requests.structures.CaseInsensitiveDict(entry['headers'])
+		response.encoding = entry['encoding']
+		response.url = entry['url']
+		response._content = body
+		response._content_consumed = True
+		return response
+
+	def store(self, key, response):
+		entry_directory = os.path.join(self.directory, key[0:2])
+		os.makedirs(entry_directory, exist_ok=True)
+		entry_path = os.path.join(entry_directory, key)
+		# Cookies would give anyone who can read the cache the session of the user, and replayed pages don't need them
+		headers = {name: value for name, value in response.headers.items() if name.lower() not in ('set-cookie', 'set-cookie2')}
+		entry = {
+			'url': response.url,
+			'status_code': response.status_code,
+			'reason': response.reason,
+			'headers': headers,
+			'encoding': response.encoding}
+		# Written under a temporary name first, so a half-written entry is never picked up
+		with open(entry_path + '.body.tmp', 'wb') as body_file:
+			body_file.write(response.content)
+		with open(entry_path + '.json.tmp', 'w', encoding='utf-8') as entry_file:
+			json.dump(entry, entry_file)
+		os.replace(entry_path + '.body.tmp', entry_path + '.body')
+		os.replace(entry_path + '.json.tmp', entry_path + '.json')
+
+class DumperSession(requests.Session):
+	def __init__(self):
+		super().__init__()
+		# Clones on other threads reuse the connections opened by this one
+		if transport_adapter is not None:
+			self.mount('https://', transport_adapter)
+			self.mount('http://', transport_adapter)
+
+	# Every request made by the script goes through here.
+	# Requests made with cache=False are neither looked up in nor stored in the cache, such as the ones sending the user's password.
+	def request(self, method, url, cache=True, **kwargs):
+		# Files are streamed, and never cached
+		if http_cache is None or not cache or kwargs.get('stream', False):
+			return self.request_uncached(method, url, **kwargs)
+
+		cache_key = http_cache.key(method, url, kwargs.get('data'))
+		cached_response = http_cache.load(cache_key)
+		if offline_mode:
+			if cached_response is None:
+				raise NotInCacheError('Page is not present in the cache: ' + url)
+			return cached_response
+
+		# Postbacks are sent every time, but are stored so they can be replayed offline
+		if method == 'GET' and cached_response is not None:
+			headers = dict(kwargs.get('headers') or {})
+			if 'ETag' in cached_response.headers:
+				headers['If-None-Match'] = cached_response.headers['ETag']
+			if 'Last-Modified' in cached_response.headers:
+				headers['If-Modified-Since'] = cached_response.headers['Last-Modified']
+			kwargs['headers'] = headers
+
+		response = self.request_uncached(method, url, **kwargs)
+		if response.status_code == 304 and cached_response is not None:
+			return cached_response
+		if response.status_code == 200:
+			http_cache.store(cache_key, response)
+		return response
+
+	def request_uncached(self, method, url, **kwargs):
+		kwargs.setdefault('timeout', request_timeout)
+		attempt = 0
+		while True:
+			try:
+				with request_slots:
+					response = super().request(method, url, **kwargs)
+				if response.status_code not in retry_status_codes or attempt >= retry_count:
+					return response
+				reason = 'HTTP ' + str(response.status_code)
+				retry_after = response.headers.get('Retry-After')
+				response.close()
+			except (requests.exceptions.ConnectionError, requests.exceptions.Timeout, requests.exceptions.ChunkedEncodingError) as e:
+				if attempt >= retry_count:
+					raise
+				reason = type(e).__name__
+				retry_after = None
+			# The request slot is given back while waiting, so other workers can carry on
+			delay = retryDelay(attempt, retry_after)
+			print('\tRequest failed ({}), trying again in {:.1f} seconds:'.format(reason, delay), url.encode('ascii', 'ignore'))
+			sleep(delay)
+			attempt += 1
+
+	# Redirects are followed by calling send() directly, so this is where each request on the wire is paid for.
+	# send() is only reached through request_uncached(), which holds a request slot. The slot is given back while waiting
+	# for a token, so that other workers whose tokens are due can use it in the meantime.
+	def send(self, request, **kwargs):
+		wait_time = request_bucket.reserve()
+		if wait_time > 0:
+			request_slots.release()
+			try:
+				sleep(wait_time)
+			finally:
+				request_slots.acquire()
+		return super().send(request, **kwargs)
+
+# HTTP/2 is not supported by requests itself, so requests are handed over to httpx instead.
+# The responses are turned back into requests responses, so the rest of the script doesn't know the difference.
+class Http2ResponseBody:
+	def __init__(self, httpx, response):
+		self.httpx = httpx
+		self.response = response
+		# requests reads the cookies set by a response from here, the way it would from a urllib3 response
+		message = http.client.HTTPMessage()
+		for name, value in response.headers.multi_items():
+			message[name] = value
+		self._original_response = SimpleNamespace(msg=message)
+
+	def stream(self, chunk_size, decode_content=True):
+		try:
+			yield from self.response.iter_bytes(chunk_size)
+		except self.httpx.TransportError as e:
+			raise requests.exceptions.ConnectionError(e)
+
+	def read(self, amount=None, decode_content=True):
+		return b''.join(self.stream(amount))
+
+	def close(self):
+		self.response.close()
+
+class Http2Adapter(requests.adapters.BaseAdapter):
+	# Headers which describe a single HTTP/1.1 connection, and are not allowed in HTTP/2
+	connection_headers = ['connection', 'keep-alive', 'proxy-connection', 'transfer-encoding', 'upgrade']
+
+	def __init__(self, httpx, pool_size):
+		super().__init__()
+		self.httpx = httpx
+		# Redirects are followed by requests
+		self.client = httpx.Client(http2=True, follow_redirects=False, limits=httpx.Limits(max_keepalive_connections=pool_size))
+
+	def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+		if isinstance(timeout, tuple):
+			timeout = self.httpx.Timeout(None, connect=timeout[0], read=timeout[1])
+		else:
+			timeout = self.httpx.Timeout(timeout)
+		headers = [(name, value) for name, value in request.headers.items() if name.lower() not in self.connection_headers]
+		http2_request = self.httpx.Request(request.method, request.url, headers=headers, content=request.body, extensions={'timeout': timeout.as_dict()})
+		try:
+			http2_response = self.client.send(http2_request, stream=True)
+		except self.httpx.TimeoutException as e:
+			raise requests.exceptions.Timeout(e, request=request)
+		except self.httpx.TransportError as e:
+			raise requests.exceptions.ConnectionError(e, request=request)
+
+		response = requests.Response()
+		response.status_code = http2_response.status_code
+		response.headers = requests.structures.CaseInsensitiveDict(http2_response.headers.items())
+		response.raw = Http2ResponseBody(self.httpx, http2_response)
+		response.reason = http2_response.reason_phrase
+		response.url = request.url
+		response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+		response.request = request
+		response.connection = self
+		requests.cookies.extract_cookies_to_jar(response.cookies, request, response.raw)
+		if not stream:
+			response.content
+		return response
+
+	def close(self):
+		self.client.close()
+
+def createTransportAdapter():
+	if not use_http2:
+		return requests.adapters.HTTPAdapter(pool_connections=connection_pool_hosts, pool_maxsize=connection_pool_size)
+	try:
+		# Only needed for HTTP/2, so it's imported here.
+		import httpx
+		return Http2Adapter(httpx, connection_pool_size)
+	except ImportError as ie:
+		print('')
+		print('!!! Could not import httpx, or its HTTP/2 support.')
+		print('HTTP/2 requires the httpx package. Install it using `pip install httpx[http2]`, or leave out --http2.')
+		print('')
+		raise ie
+
+def retryDelay(attempt, retry_after=None):
+	# Half of the delay is random, so workers which failed at the same time don't all retry at the same time
+	delay_limit = min(retry_backoff_limit, retry_backoff * 2 ** attempt)
+	delay = delay_limit / 2 + random.uniform(0, delay_limit / 2)
+	# The server may say how long it wants us to wait
+	if retry_after is not None and retry_after.isdigit():
+		delay = max(delay, min(retry_backoff_limit, int(retry_after)))
+	return delay
+
+def clone_session(session):
+	# Sessions are not safe to share between threads, but the cookie jar is.
+	# The clone is logged in as well, since the cookies obtained when logging in are shared.
+	cloned_session = DumperSession()
+	cloned_session.cookies = session.cookies
+	cloned_session.headers.update(session.headers)
+	cloned_session.original_session = session
+	return cloned_session
+
+def thread_session(session):
+	# Returns a clone of the given session that belongs to the calling thread
+	# Clones handed to pools within pools are traced back to the session they were cloned from, so each thread only needs one clone.
+	session = getattr(session, 'original_session', session)
+	if threading.current_thread() is threading.main_thread():
+		return session
+	if getattr(thread_local_state, 'parent_session', None) is not session:
+		thread_local_state.parent_session = session
+		thread_local_state.session = clone_session(session)
+	return thread_local_state.session
+
+class Manifest:
+	# Items are written to disk in batches of this size. Losing a batch only means those items are downloaded again.
+	commit_interval = 50
+
+	def __init__(self, path):
+		self.lock = threading.Lock()
+		self.uncommitted_count = 0
+		self.connection = sqlite3.connect(path, check_same_thread=False)
+		self.connection.execute('CREATE TABLE IF NOT EXISTS items (kind TEXT NOT NULL, item_id TEXT NOT NULL, fingerprint TEXT NOT NULL, last_seen TEXT NOT NULL, PRIMARY KEY (kind, item_id))')
+		self.connection.commit()
+
+	def lookup(self, kind, item_id):
+		with self.lock:
+			row = self.connection.execute('SELECT fingerprint FROM items WHERE kind = ? AND item_id = ?', (kind, str(item_id))).fetchone()
+		return row[0] if row is not None else None
+
+	def record(self, kind, item_id, fingerprint):
+		with self.lock:
+			self.connection.execute("INSERT OR REPLACE INTO items (kind, item_id, fingerprint, last_seen) VALUES (?, ?, ?, datetime('now'))", (kind, str(item_id), fingerprint))
+			self.uncommitted_count += 1
+			if self.uncommitted_count >= self.commit_interval:
+				self.connection.commit()
+				self.uncommitted_count = 0
+
+	def close(self):
+		with self.lock:
+			self.connection.commit()
+			self.connection.close()
+
+class FailedItems:
+	# Every item is appended as soon as it failed, so the list survives the script being closed.
+	# Paths are stored relative to the output directory.
+	def __init__(self, path):
+		self.path = path
+		self.lock = threading.Lock()
+		self.count = 0
+
+	def record(self, kind, error_information, **fields):
+		if fields.get('path') is not None:
+			fields['path'] = os.path.relpath(fields['path'], output_folder_name)
+		entry = dict(fields, kind=kind, error=error_information.strip().split('\n')[-1])
+		with self.lock:
+			with open(self.path, 'a', encoding='utf-8') as failed_items_file:
+				failed_items_file.write(json.dumps(entry) + '\n')
+			self.count += 1
+
+	@staticmethod
+	def load(path):
+		entries = []
+		with open(path, encoding='utf-8') as failed_items_file:
+			for line in failed_items_file:
+				try:
+					entry = json.loads(line)
+				except ValueError:
+					continue
+				if entry.get('path') is not None:
+					entry['path'] = os.path.join(output_folder_name, entry['path'])
+				entries.append(entry)
+		return entries
+
+def recordFailure(kind, error_information, **fields):
+	if failed_items is not None:
+		failed_items.record(kind, error_information, **fields)
+
+# Both of these do nothing unless an incremental dump is being made.
+def isItemUnchanged(kind, item_id, fingerprint=''):
+	return manifest is not None and manifest.lookup(kind, item_id) == fingerprint
+
+# Bulletins and messages are numbered by their position on the page. In incremental dumps a new one would shift
+# the numbers of all older ones, so they are numbered by their ID instead, which keeps each item in the same file.
+def itemFileNumber(index, item_id):
+	if manifest is not None and item_id is not None:
+		return str(item_id)
+	return str(index)
+
+def recordItem(kind, item_id, fingerprint=''):
+	if manifest is None:
+		return
+	if output_writer is not None:
+		output_writer.defer(manifest.record, kind, item_id, fingerprint)
+	else:
+		manifest.record(kind, item_id, fingerprint)
+
+# Most pages carry a __VIEWSTATE field of up to hundreds of kilobytes, which is only needed to send postbacks.
+# Parsing is a lot faster without it, so it's cut out unless the page is used for a postback (or its forms are used otherwise).
+def stripViewState(text):
+	if isinstance(text, bytes):
+		name_marker, value_marker, quote, tag_end = b'name="__VIEWSTATE"', b'value="', b'"', b'>'
+	else:
+		name_marker, value_marker, quote, tag_end = 'name="__VIEWSTATE"', 'value="', '"', '>'
+	name_index = text.find(name_marker)
+	if name_index == -1:
+		return text
+	value_start = text.find(value_marker, name_index)
+	# The value has to belong to the same tag
+	if value_start == -1 or value_start > text.find(tag_end, name_index):
+		return text
+	value_start += len(value_marker)
+	value_end = text.find(quote, value_start)
+	return text[:value_start] + text[value_end:]
+
+# lxml parsers can be reused, but not shared between threads
+def htmlParser():
+	parser = getattr(thread_local_state, 'html_parser', None)
+	if parser is None:
+		parser = thread_local_state.html_parser = HTMLParser()
+	return parser
+
+def parseDocument(text, postback=False):
+	if not postback:
+		text = stripViewState(text)
+	return fromstring(text, parser=htmlParser())
+
+class Page:
+	# Wraps a response. Its text is decoded only once, and the document is only parsed once, however often they are used.
+	def __init__(self, response):
+		self.response = response
+		self.url = response.url
+		self.status_code = response.status_code
+		self.headers = response.headers
+		self.decoded_text = None
+		self.documents = {}
+		# See commentModules()
+		self.comment_modules = None
+
+	@property
+	def content(self):
+		return self.response.content
+
+	@property
+	def text(self):
+		if self.decoded_text is None:
+			self.decoded_text = self.response.text
+		return self.decoded_text
+
+	# Pages which don't state their character set in the Content-Type header are decoded as ISO-8859-1 by requests.
+	# Parsing the raw bytes instead lets lxml pick up the character set from the <meta> tag of the page.
+	def document(self, postback=False, from_bytes=False):
+		if (postback, from_bytes) not in self.documents:
+			self.documents[(postback, from_bytes)] = parseDocument(self.content if from_bytes else self.text, postback)
+		return self.documents[(postback, from_bytes)]
+
+def fetchPage(session, url, **kwargs):
+	return Page(session.get(url, **kwargs))
+
+def benchmarkParsing(cache_directory):
+	# Parses every page in the HTTP cache, both the way pages used to be parsed and the way they are parsed now.
+	page_types = {}
+	for directory_path, directory_names, file_names in os.walk(cache_directory):
+		for file_name in file_names:
+			if not file_name.endswith('.json'):
+				continue
+			entry_path = os.path.join(directory_path, file_name[:-len('.json')])
+			try:
+				with open(entry_path + '.json', encoding='utf-8') as entry_file:
+					entry = json.load(entry_file)
+				with open(entry_path + '.body', 'rb') as body_file:
+					body = body_file.read()
+			except (OSError, ValueError):
+				continue
+			content_type = requests.structures.CaseInsensitiveDict(entry['headers']).get('Content-Type', '')
+			if 'html' not in content_type:
+				continue
+			text = body.decode(entry['encoding'] or 'utf-8', errors='replace')
+			page_type = urlparse(entry['url']).path.split('/')[-1].lower() or '/'
+
+			start_time = monotonic()
+			fromstring(text)
+			full_parse_time = monotonic() - start_time
+			start_time = monotonic()
+			parseDocument(text)
+			fast_parse_time = monotonic() - start_time
+
+			statistics = page_types.setdefault(page_type, [0, 0, 0, 0])
+			statistics[0] += 1
+			statistics[1] += len(body)
+			statistics[2] += full_parse_time
+			statistics[3] += fast_parse_time
+
+	if len(page_types) == 0:
+		print('No cached pages were found in', cache_directory)
+		print('Run the script with --http-cache first to fill the cache.')
+		return
+
+	print('{:<40} {:>6} {:>10} {:>14} {:>14}'.format('Page', 'Count', 'Avg. KB', 'Full (ms)', 'Stripped (ms)'))
+	for page_type, (count, total_size, full_parse_time, fast_parse_time) in sorted(page_types.items(), key=lambda item: -item[1][2]):
+		print('{:<40} {:>6} {:>10.1f} {:>14.2f} {:>14.2f}'.format(page_type[0:40], count, total_size / count / 1024, full_parse_time / count * 1000, fast_parse_time / count * 1000))
+
+def benchmarkSanitising():
+	# Cleans up a set of made up, but typical, paths and names, both the way it used to be done and the way it is done now.
+	def oldSanitisePath(filePath):
+		for character in invalid_path_characters:
+			if os.name == 'nt' and os.path.isabs(filePath) and character == ':':
+				filePath = filePath[0:2] + filePath[2:].replace(character, '')
+			else:
+				filePath = filePath.replace(character, '')
+		return '/'.join([m.strip() for m in filePath.split('/')])
+
+	def oldSanitiseFilename(filename):
+		for character in invalid_filename_characters:
+			filename = filename.replace(character, '')
+		return filename
+
+	directories = [os.path.abspath('dump') + '/Courses/Course ' + str(course) + ' - TDT4100: Object-oriented programming, spring ' + str(2000 + course) + '/Folder ' + str(folder) + ' ' for course in range(20) for folder in range(10)]
+	paths = [directory + '/Lecture notes, week ' + str(week) + '? <draft>.pdf' for directory in directories for week in range(25)]
+	names = ['Thread - "Re: Re: Question about exercise ' + str(index) + '?" 12.03.2019 14:05' for index in range(len(paths))]
+
+	cleanDirectoryPath.cache_clear()
+	for path in paths:
+		assert sanitisePath(path) == oldSanitisePath(path), path
+	for name in names:
+		assert sanitiseFilename(name) == oldSanitiseFilename(name), name
+	cleanDirectoryPath.cache_clear()
+
+	print('{:<20} {:>8} {:>12} {:>12}'.format('Function', 'Calls', 'Old (us)', 'New (us)'))
+	for function_name, values, old_function, new_function in [('sanitisePath', paths, oldSanitisePath, sanitisePath), ('sanitiseFilename', names, oldSanitiseFilename, sanitiseFilename)]:
+		timings = []
+		for function in [old_function, new_function]:
+			start_time = monotonic()
+			for value in values:
+				function(value)
+			timings.append(monotonic() - start_time)
+		print('{:<20} {:>8} {:>12.2f} {:>12.2f}'.format(function_name, len(values), timings[0] / len(values) * 1000000, timings[1] / len(values) * 1000000))
 
 def convert_html_content(html_string):
 	unescaped = html.unescape(html_string).split('\n')
 	return '\n'.join([string.strip() for string in unescaped])
 
+def removeCharacters(text, characters):
+	# For strings this short, a str.replace() per character is faster than str.translate() or a regex.
+	for character in characters:
+		text = text.replace(character, '')
+	return text
+
+def cleanPath(filePath):
+	characters = invalid_path_characters
+	# Fix for absolute paths on windows
+	if os.name == 'nt' and os.path.isabs(filePath):
+		filePath = filePath[0:2] + filePath[2:].replace(':', '')
+		characters = [character for character in characters if character != ':']
+	filePath = removeCharacters(filePath, characters)
+	return '/'.join([m.strip() for m in filePath.split('/')])
+
+# Files are mostly dumped into the same few directories, so those only need to be cleaned up once.
+@lru_cache(maxsize=4096)
+def cleanDirectoryPath(directoryPath):
+	return cleanPath(directoryPath)
+
 def sanitisePath(filePath):
-	# I don't care about efficiency.
-	for character in invalid_path_characters:
-		# Fix for absolute paths on windows
-		if os.name == 'nt' and os.path.isabs(filePath) and character == ':':
-			filePath = filePath[0:2] + filePath[2:].replace(character, '')
-		else:
-			filePath = filePath.replace(character, '')
-	filePath = '/'.join([m.strip() for m in filePath.split('/')])
-	return filePath
+	directoryPath, separator, name = filePath.rpartition('/')
+	# The drive letter and the slash after it must end up in the directory part
+	if len(directoryPath) < 3:
+		return cleanPath(filePath)
+	return cleanDirectoryPath(directoryPath) + '/' + removeCharacters(name, invalid_path_characters).strip()
 
 def createUniqueFilename(path):
 	path_exported = Path(path)
 	folder_parts = path_exported.parts[0:-1]
 	file_name = '.'.join(path_exported.name.split('.')[0:-1])
 	extension = path_exported.name.split('.')[-1]
-	count = 1
-	while os.path.exists(path):
-		path = '/'.join(folder_parts) + '/' + file_name + ' (Duplicate ' + str(count) + ').' + extension
-		count += 1
+	directory_key = os.path.normcase(os.path.abspath(str(path_exported.parent)))
+	with path_registry_lock:
+		if directory_key not in listed_directories:
+			listed_directories.add(directory_key)
+			try:
+				for entry in os.listdir(directory_key):
+					claimed_paths.add(os.path.join(directory_key, os.path.normcase(entry)))
+			except OSError:
+				pass
+		count = 1
+		while os.path.join(directory_key, os.path.normcase(os.path.basename(path))) in claimed_paths:
+			path = '/'.join(folder_parts) + '/' + file_name + ' (Duplicate ' + str(count) + ').' + extension
+			count += 1
+		# The name is taken as soon as it is handed out, so two workers never get the same one
+		claimed_paths.add(os.path.join(directory_key, os.path.normcase(os.path.basename(path))))
 	return path
 
 def sanitiseFilename(filename):
-	for character in invalid_filename_characters:
-		filename = filename.replace(character, '')
-	return filename
+	return removeCharacters(filename, invalid_filename_characters)
 
 def makeDirectories(path):
 	cleaned_path = sanitisePath(path)
 	abs_path = os.path.abspath(cleaned_path)
+	# Archives don't need directories to exist up front
+	if packed_output is not None:
+		return abs_path
+	directory_key = os.path.normcase(abs_path)
+	with path_registry_lock:
+		if directory_key in created_directories:
+			return abs_path
 	if not os.path.exists(abs_path):
 		try: 
 			os.makedirs(abs_path)
+			with path_registry_lock:
+				created_directories.add(directory_key)
+				# We just created it, so there is nothing in it yet
+				listed_directories.add(directory_key)
+		except FileExistsError:
+			# Another worker beat us to it
+			pass
 		except FileNotFoundError:
 			print('COULD NOT CREATE A FOLDER AT: ')
 			print(abs_path.encode('ascii', 'ignore'))
 			print('If you\'re on Windows this can happen due to Windows being unable to handle paths longer than 255 characters.')
 			print('Any files dumped in these directories will be redirected to the overflow directory.')
+	else:
+		with path_registry_lock:
+			created_directories.add(directory_key)
 	return abs_path
 
 # Windows has this amazing feature called "255 character file path limit"
 # Here's a function made specifically for countering this issue.
-def dumpToOverflow(content, filename):
+# If the content was already written to a temporary file, that file is moved in place instead.
+def dumpToOverflow(content, filename, temporary_path=None):
 	global overflow_count
-	overflow_count += 1
+	with overflow_lock:
+		overflow_count += 1
+		overflow_index = overflow_count
 	filepath, basename = os.path.split(os.path.normpath(sanitisePath(filename)))
 	dirtree = filepath.split(os.sep)
 	overflowDirectory = output_folder_name + '/' + dirtree[2] + '/Overflowed Files'
 	if not os.path.exists(overflowDirectory):
 		overflowDirectory = makeDirectories(overflowDirectory)
-	total_path = sanitisePath(overflowDirectory + '/' + str(overflow_count) + '_' + basename)
-	with open(total_path, 'wb') as file:
-		file.write(content)
+	total_path = sanitisePath(overflowDirectory + '/' + str(overflow_index) + '_' + basename)
+	if temporary_path is not None:
+		os.replace(temporary_path, total_path)
+	else:
+		with open(total_path, 'wb') as file:
+			file.write(content)
 	# Create a txt file with original file location
 	overflow_info_txt_filename = os.path.splitext(os.path.normpath(total_path))[0] + '.txt'
 	original_location = ('Original file path: ' + filename).encode('utf-8')
-	bytesToTextFile(original_location, overflow_info_txt_filename)
+	writeTextFile(original_location, overflow_info_txt_filename)
 	print('FILE WAS WRITTEN TO OVERFLOW DIRECTORY - path too long (Windows issue)')
 	print('Original file path:', filename.encode('ascii', 'ignore'))
 	print('New file path:', total_path.encode('ascii', 'ignore'))
 
-def bytesToTextFile(content, filename):
+class PackedOutput:
+	# Courses and projects get an archive each, as does the inbox of every institution.
+	# These are the folders whose contents are spread out over more than one level of the output directory.
+	nested_folders = ['Projects', 'Messaging']
+
+	def __init__(self, root, pack_format):
+		self.root = root
+		self.pack_format = pack_format
+		self.lock = threading.Lock()
+		self.archives = {}
+		self.index_file = open(os.path.join(root, pack_index_name), 'a', encoding='utf-8')
+
+	def openArchive(self, path):
+		# Returns the archive a file at the given path should be written to, along with its name inside the archive
+		parts = Path(os.path.relpath(path, self.root)).parts
+		depth = 2 if parts[0] in self.nested_folders else 1
+		depth = min(depth, len(parts) - 1)
+		archive_key = parts[0:depth] if depth > 0 else ('Other',)
+		entry_name = '/'.join(parts[depth:])
+		with self.lock:
+			if archive_key not in self.archives:
+				archive_path = os.path.join(self.root, *archive_key) + '.' + self.pack_format
+				os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+				# Archives are appended to, so a resumed dump adds to what was already there
+				if self.pack_format == 'zip':
+					archive = zipfile.ZipFile(archive_path, 'a', compression=zipfile.ZIP_DEFLATED)
+					entry_names = set(archive.namelist())
+				else:
+					archive = tarfile.open(archive_path, 'a')
+					entry_names = set(archive.getnames())
+				self.archives[archive_key] = (archive, threading.Lock(), entry_names, os.path.relpath(archive_path, self.root))
+		return self.archives[archive_key], entry_name
+
+	def write(self, path, content=None, source_path=None):
+		(archive, archive_lock, entry_names, archive_name), entry_name = self.openArchive(path)
+		with archive_lock:
+			# Same naming scheme as createUniqueFilename()
+			unique_entry_name = entry_name
+			count = 1
+			while unique_entry_name in entry_names:
+				base_name, extension = os.path.splitext(entry_name)
+				unique_entry_name = base_name + ' (Duplicate ' + str(count) + ')' + extension
+				count += 1
+			entry_names.add(unique_entry_name)
+
+			if self.pack_format == 'zip':
+				if content is not None:
+					archive.writestr(unique_entry_name, content)
+				else:
+					# Downloaded files are often compressed already
+					archive.write(source_path, unique_entry_name, compress_type=zipfile.ZIP_STORED)
+			else:
+				if content is not None:
+					entry_info = tarfile.TarInfo(unique_entry_name)
+					entry_info.size = len(content)
+					entry_info.mtime = time()
+					archive.addfile(entry_info, io.BytesIO(content))
+				else:
+					archive.add(source_path, unique_entry_name)
+		with self.lock:
+			self.index_file.write(json.dumps({'archive': archive_name, 'entry': unique_entry_name}, ensure_ascii=False) + '\n')
+		return unique_entry_name
+
+	def close(self):
+		with self.lock:
+			for archive, archive_lock, entry_names, archive_name in self.archives.values():
+				with archive_lock:
+					archive.close()
+			self.archives = {}
+			self.index_file.close()
+
+class Pipeline:
+	# Items are pushed through a series of stages. Each stage is a function which is run by a number of threads,
+	# and returns the items which should be handed to the next stage (or None).
+	# Every stage reads from a bounded queue, so a stage which falls behind holds up the ones in front of it rather than piling up work.
+	# Only the threads of discussion forums are dumped this way, since those are many pages which each go through every stage.
+	# Other items are mostly a single page, or have a pool of fetchers of their own (bulletins, messages, submissions, test attempts
+	# and folders), and all of them leave writing to the background writer, so they already overlap network, parsing and disk.
+	def __init__(self, stages, error_handler, queue_size=pipeline_queue_size):
+		self.queues = [queue.Queue(maxsize=queue_size) for stage in stages]
+		self.threads = []
+		self.abort_exception = None
+		self.error_handler = error_handler
+		# Files written by the stages belong to the scope the pipeline was started in
+		self.write_scope = currentWriteScope()
+		for stage_index, (function, thread_count) in enumerate(stages):
+			stage_threads = []
+			for i in range(thread_count):
+				thread = threading.Thread(target=self.runStage, args=(stage_index, function), daemon=True)
+				thread.start()
+				stage_threads.append(thread)
+			self.threads.append(stage_threads)
+
+	def put(self, item):
+		self.queues[0].put(item)
+
+	def runStage(self, stage_index, function):
+		thread_local_state.write_scope = self.write_scope
+		input_queue = self.queues[stage_index]
+		while True:
+			item = input_queue.get()
+			if item is end_of_queue:
+				return
+			# After the user aborted, remaining items are drained without being processed, so no stage gets stuck on a full queue.
+			if self.abort_exception is not None:
+				continue
+			try:
+				results = function(item)
+				if results is not None and stage_index + 1 < len(self.queues):
+					for result in results:
+						self.queues[stage_index + 1].put(result)
+			except Exception:
+				try:
+					self.error_handler(item, traceback.format_exc())
+				except BaseException as e:
+					self.abort_exception = e
+			except BaseException as e:
+				self.abort_exception = e
+
+	def close(self):
+		# Stages are shut down one by one, so all items in the pipeline are processed before it is closed.
+		for input_queue, stage_threads in zip(self.queues, self.threads):
+			for thread in stage_threads:
+				input_queue.put(end_of_queue)
+			for thread in stage_threads:
+				thread.join()
+		if self.abort_exception is not None:
+			raise self.abort_exception
+
+class WriteScope:
+	# Text files are written in the background, so a failed write can't be raised in the code that queued the file.
+	# Instead, the failure is marked on the scope the file was queued in and all scopes around it, up to the nearest one with an
+	# `on_failure` function. That function is called once with the error, so the item the scope belongs to can be reported as failed.
+	# Calls deferred in a failed scope are dropped, so nothing in it is recorded as done.
+	# Scopes belong to the thread that entered them; work handed to other threads is wrapped with withWriteScope().
+	def __init__(self, on_failure=None):
+		self.on_failure = on_failure
+		self.parent = currentWriteScope()
+		self.previous_scopes = []
+
+		# Only used by the writer thread
+		self.failed = False
+		self.reported = False
+
+	def __enter__(self):
+		self.previous_scopes.append(currentWriteScope())
+		thread_local_state.write_scope = self
+		return self
+
+	def __exit__(self, *exception):
+		thread_local_state.write_scope = self.previous_scopes.pop()
+
+	# Returns False if no scope handled the failure
+	def fail(self, error_information):
+		scope = self
+		while scope is not None:
+			scope.failed = True
+			if scope.on_failure is not None:
+				if not scope.reported:
+					scope.reported = True
+					scope.on_failure(error_information)
+				return True
+			scope = scope.parent
+		return False
+
+def currentWriteScope():
+	return getattr(thread_local_state, 'write_scope', None)
+
+# Runs the function in a scope of its own within the scope of the calling thread, for functions submitted to a pool.
+def withWriteScope(function):
+	parent_scope = currentWriteScope()
+	def runInScope(*arguments):
+		thread_local_state.write_scope = parent_scope
+		try:
+			with WriteScope():
+				return function(*arguments)
+		finally:
+			thread_local_state.write_scope = None
+	return runInScope
+
+class OutputWriter:
+	# Writes text files on a background thread, so workers can move on to the next page right away.
+	# Files are still written one at a time; up to `batch_size` of them are taken off the queue at once, so the queue's lock
+	# isn't fought over for every single file while workers keep adding to it.
+	def __init__(self, queue_size, batch_size):
+		self.queue = queue.Queue(maxsize=queue_size)
+		self.batch_size = batch_size
+		self.thread = threading.Thread(target=self.run, daemon=True)
+		self.thread.start()
+
+	def write(self, content, filename):
+		self.queue.put((None, (content, filename), currentWriteScope()))
+
+	# Calls the function once every file queued before it has been written.
+	# The call is dropped if a file queued in the same write scope could not be written, so the item isn't recorded as done.
+	def defer(self, function, *arguments):
+		self.queue.put((function, arguments, currentWriteScope()))
+
+	def run(self):
+		while True:
+			batch = [self.queue.get()]
+			while len(batch) < self.batch_size:
+				try:
+					batch.append(self.queue.get_nowait())
+				except queue.Empty:
+					break
+			for entry in batch:
+				if entry is end_of_queue:
+					return
+				function, arguments, scope = entry
+				if function is not None:
+					if scope is None or not scope.failed:
+						try:
+							function(*arguments)
+						except Exception:
+							with console_lock:
+								traceback.print_exc()
+					continue
+				content, filename = arguments
+				try:
+					writeTextFile(content, filename)
+				except Exception:
+					error_information = traceback.format_exc()
+					with console_lock:
+						print(error_information)
+						print('Failed to write file:', filename.encode('ascii', 'ignore'))
+					try:
+						if scope is None or not scope.fail(error_information):
+							recordFailure('text file', error_information, path=os.path.abspath(sanitisePath(filename)))
+					except Exception:
+						with console_lock:
+							traceback.print_exc()
+
+	def close(self):
+		if self.thread.is_alive():
+			self.queue.put(end_of_queue)
+			self.thread.join()
+
+def writeTextFile(content, filename):
 	filename = sanitisePath(filename)
+	if packed_output is not None:
+		packed_output.write(os.path.abspath(filename), content=content)
+		return
 	filename = os.path.abspath(createUniqueFilename(filename))
 	if len(filename) >= 254 and 'Windows' in platform.system():
 		dumpToOverflow(content, filename)
@@ -329,6 +1417,12 @@ def bytesToTextFile(content, filename):
 		with open(filename, 'wb') as file:
 			file.write(content)
 
+def bytesToTextFile(content, filename):
+	if output_writer is not None:
+		output_writer.write(content, filename)
+	else:
+		writeTextFile(content, filename)
+
 # Conversion between formats of one library to another
 def convert_lxml_form_to_requests(lxml_form_values):
 	form_dict = {}
@@ -337,43 +1431,180 @@ def convert_lxml_form_to_requests(lxml_form_values):
 	return form_dict
 
 def do_feide_relay(session, relay_response):
-	relay_page = fromstring(relay_response.text)
+	relay_page = parseDocument(relay_response.text, postback=True)
 	relay_form = relay_page.forms[0]
 
 	relay_form_dict = convert_lxml_form_to_requests(relay_form)
 
-	return session.post(relay_form.action, data = relay_form_dict)
-
-def download_file(institution, url, destination_directory, session, index=None, filename=None, disableFilenameReencode=False):
+	return session.post(relay_form.action, data = relay_form_dict, cache=False)
+
+def partialDownloadPaths(url):
+	partial_directory = os.path.join(output_folder_name, partial_downloads_directory_name)
+	os.makedirs(partial_directory, exist_ok=True)
+	url_hash = hashlib.sha1(url.encode('utf-8')).hexdigest()
+	part_path = os.path.join(partial_directory, url_hash + '.part')
+	return part_path, part_path + '.json'
+
+def partialDownloadLock(part_path):
+	# The same file can be linked from several places, and two workers should not write to the same partial file.
+	with partial_download_locks_lock:
+		if part_path not in partial_download_locks:
+			partial_download_locks[part_path] = threading.Lock()
+		return partial_download_locks[part_path]
+
+def savePartialDownloadState(state_path, download_state):
+	with open(state_path + '.tmp', 'w') as state_file:
+		json.dump(download_state, state_file)
+		state_file.flush()
+		os.fsync(state_file.fileno())
+	os.replace(state_path + '.tmp', state_path)
+
+def requestDownload(session, url):
+	# Sends the request for a file, continuing from a partial download if there is one.
+	# Returns the response, and the number of bytes of the partial file it continues from (0 if starting from scratch).
+	# The partial file is locked for the calling thread from here on, until the download is saved.
+	part_path, state_path = partialDownloadPaths(url)
+	part_lock = partialDownloadLock(part_path)
+	part_lock.acquire()
 	try:
-		file_download_response = session.get(url, allow_redirects=True)
-	except Exception:
-		# Can occur in a case of an encoded image. If so, dump it.
-		if base64_png_image_url[institution] in url or base64_jpeg_image_url[institution] in url:
-			try:
-				extension = url.split(':')[2].split(';')[0].split('/')[1]
-				print('\tDownloaded Base64 encoded {} image'.format(extension).encode('ascii', 'ignore'))
-				start_index = url.index(',') + 1
-				base64_encoded_file_contents = url[start_index:]
-				decoded_bytes = base64.b64decode(base64_encoded_file_contents)
-				bytesToTextFile(decoded_bytes, destination_directory + '/' + base64_encoded_file_contents[0:10] + '.' + extension)
-			except Exception:
-				print('Base64 Image Download Failed: unknown umage formatting. Skipping.')
-			return
-		elif url.startswith('/'):
+		headers = {}
+		offset = 0
+		if os.path.exists(part_path) and os.path.exists(state_path):
 			try:
-				file_download_response = session.get(itslearning_root_url[institution] + url, allow_redirects=True)
-			except Exception:
-				print('FAILED TO DOWNLOAD FILE (INVALID URL):', url.encode('ascii', 'ignore'))
-				return
+				with open(state_path) as state_file:
+					download_state = json.load(state_file)
+			except ValueError:
+				download_state = {}
+			# Without a validator there's no telling whether the file changed in the meantime
+			validator = download_state.get('etag') or download_state.get('last_modified')
+			if download_state.get('url') == url and validator is not None and download_state.get('offset', 0) > 0:
+				offset = download_state['offset']
+				headers['Range'] = 'bytes={}-'.format(offset)
+				headers['If-Range'] = validator
+
+		file_download_response = session.get(url, allow_redirects=True, stream=True, headers=headers)
+
+		if offset > 0:
+			content_range = file_download_response.headers.get('Content-Range', '')
+			if file_download_response.status_code == 206 and content_range.startswith('bytes {}-'.format(offset)):
+				print('\tResuming interrupted download at byte', offset)
+			elif file_download_response.status_code == 416:
+				# The partial file doesn't fit the file on the server, so we start over, still holding the lock.
+				file_download_response.close()
+				os.remove(state_path)
+				offset = 0
+				file_download_response = session.get(url, allow_redirects=True, stream=True)
+			else:
+				# The server ignored the range or the file has changed; a complete file is coming our way.
+				offset = 0
+
+		# Otherwise the error page would be saved as the file
+		if file_download_response.status_code < 200 or file_download_response.status_code >= 300:
+			file_download_response.close()
+			raise UnexpectedStatusError('HTTP {} for {}'.format(file_download_response.status_code, url))
+	except BaseException:
+		part_lock.release()
+		raise
+	return file_download_response, offset
+
+def linkFile(source_path, destination_path):
+	try:
+		os.link(source_path, destination_path)
+		return
+	except OSError:
+		pass
+	# Some file systems (btrfs, XFS) can't do hard links in every situation, but can share the data of a copy instead.
+	try:
+		import fcntl
+		with open(source_path, 'rb') as source_file, open(destination_path, 'wb') as destination_file:
+			# FICLONE, from linux/fs.h
+			fcntl.ioctl(destination_file.fileno(), 0x40049409, source_file.fileno())
+		return
+	except (ImportError, OSError):
+		pass
+	copyfile(source_path, destination_path)
+
+def storeDeduplicatedFile(source_path, content_hash, destination_path):
+	blob_directory = os.path.join(output_folder_name, blob_store_directory_name, content_hash[0:2])
+	blob_path = os.path.join(blob_directory, content_hash)
+	with blob_store_lock:
+		if os.path.exists(blob_path):
+			print('\tFile has been downloaded before, linking to the existing copy.')
+			os.remove(source_path)
 		else:
-			print('FAILED TO DOWNLOAD FILE (INVALID URL):', url.encode('ascii', 'ignore'))
-			return
-	
+			os.makedirs(blob_directory, exist_ok=True)
+			os.replace(source_path, blob_path)
+		linkFile(blob_path, destination_path)
+		with open(os.path.join(output_folder_name, blob_store_directory_name, blob_store_index_name), 'a', encoding='utf-8') as index_file:
+			index_file.write(json.dumps({'hash': content_hash, 'path': os.path.relpath(destination_path, output_folder_name)}) + '\n')
+
+def finishDownload(part_path, content_hash, total_file_name):
+	# Moves a completed download to its final location
+	if packed_output is not None:
+		packed_output.write(total_file_name, source_path=part_path)
+		os.remove(part_path)
+		return
+	total_file_name = createUniqueFilename(total_file_name)
+	if len(total_file_name) >= 255 and 'Windows' in platform.system():
+		dumpToOverflow(None, total_file_name, temporary_path=part_path)
+	elif content_hash is not None:
+		storeDeduplicatedFile(part_path, content_hash.hexdigest(), total_file_name)
+	else:
+		os.replace(part_path, total_file_name)
+
+def saveDownload(url, file_download_response, offset, total_file_name):
+	# Streams the body of a response obtained through requestDownload() to disk.
+	part_path, state_path = partialDownloadPaths(url)
+	part_lock = partialDownloadLock(part_path)
+	try:
+		# The file is streamed into a partial file first, and only moved to its final location once it is complete.
+		# It lives in the output directory, so its path is short and the move is a rename on the same disk.
+		# Along with it we store how far we got, so an interrupted download can be continued later.
+		download_state = {
+			'url': url,
+			'etag': file_download_response.headers.get('ETag'),
+			'last_modified': file_download_response.headers.get('Last-Modified'),
+			'offset': offset}
+		content_hash = hashlib.sha256() if deduplicate_files else None
+		with open(part_path, 'r+b' if offset > 0 else 'wb') as part_file:
+			part_file.truncate(offset)
+			if content_hash is not None and offset > 0:
+				# The part we already had needs to be included in the hash as well
+				for chunk in iter(lambda: part_file.read(download_chunk_size), b''):
+					content_hash.update(chunk)
+			part_file.seek(offset)
+			savePartialDownloadState(state_path, download_state)
+			bytes_since_save = 0
+			try:
+				for chunk in file_download_response.iter_content(chunk_size=download_chunk_size):
+					part_file.write(chunk)
+					if content_hash is not None:
+						content_hash.update(chunk)
+					download_state['offset'] += len(chunk)
+					bytes_since_save += len(chunk)
+					if bytes_since_save >= partial_download_save_interval:
+						part_file.flush()
+						os.fsync(part_file.fileno())
+						savePartialDownloadState(state_path, download_state)
+						bytes_since_save = 0
+			except BaseException:
+				part_file.flush()
+				os.fsync(part_file.fileno())
+				savePartialDownloadState(state_path, download_state)
+				print('\tDownload interrupted after {} bytes. It will be resumed the next time it is downloaded.'.format(download_state['offset']))
+				raise
+
+		finishDownload(part_path, content_hash, total_file_name)
+		os.remove(state_path)
+	finally:
+		file_download_response.close()
+		part_lock.release()
+
+def downloadFilename(headers, url, filename, index, disableFilenameReencode):
 	# If links are not directed to it's learning, the header format might be different
 	if filename is None:
 		try:
-			filename_header = file_download_response.headers['Content-Disposition']
+			filename_header = headers['Content-Disposition']
 			filename_start = filename_header.split('filename="')[1]
 			filename_end = filename_start.find('"')
 			filename = filename_start[0:filename_end]
@@ -397,27 +1628,71 @@ def download_file(institution, url, destination_directory, session, index=None,
 	# Special case where the server puts slashes in the file name
 	# sanitiseFilename() cuts away too many characters here.
 	filename = filename.replace('/', '')
-	
-	print('\tDownloaded', filename.encode('ascii', 'ignore'))
-	if not os.path.exists(destination_directory):
-		destination_directory = makeDirectories(destination_directory)
+	return filename
 
+# Downloads that fail, even after retrying, are added to the list of failed items, unless the caller reports the failure itself.
+def reportFailedDownload(institution, url, destination_directory, index, filename, disableFilenameReencode, report_failure):
+	error_information = traceback.format_exc()
+	print('FAILED TO DOWNLOAD FILE:', url.encode('ascii', 'ignore'))
+	print('\t' + error_information.strip().split('\n')[-1])
+	if report_failure:
+		recordFailure('file', error_information, institution=institution, path=destination_directory, url=url, index=index, filename=filename, disable_filename_reencode=disableFilenameReencode)
+
+# Returns the name of the saved file, or None if nothing was saved.
+def download_file(institution, url, destination_directory, session, index=None, filename=None, disableFilenameReencode=False, report_failure=True):
+	if offline_mode:
+		print('\tNot downloading file in offline mode:', url.encode('ascii', 'ignore'))
+		return None
+
+	download_url = url
+	try:
+		file_download_response, offset = requestDownload(session, download_url)
+	except Exception:
+		# Can occur in a case of an encoded image. If so, dump it.
+		if base64_png_image_url[institution] in url or base64_jpeg_image_url[institution] in url:
+			try:
+				extension = url.split(':')[2].split(';')[0].split('/')[1]
+				print('\tDownloaded Base64 encoded {} image'.format(extension).encode('ascii', 'ignore'))
+				start_index = url.index(',') + 1
+				base64_encoded_file_contents = url[start_index:]
+				decoded_bytes = base64.b64decode(base64_encoded_file_contents)
+				filename = base64_encoded_file_contents[0:10] + '.' + extension
+				bytesToTextFile(decoded_bytes, destination_directory + '/' + filename)
+				return filename
+			except Exception:
+				print('Base64 Image Download Failed: unknown umage formatting. Skipping.')
+			return
+		elif url.startswith('/'):
+			try:
+				download_url = itslearning_root_url[institution] + url
+				file_download_response, offset = requestDownload(session, download_url)
+			except Exception:
+				reportFailedDownload(institution, url, destination_directory, index, filename, disableFilenameReencode, report_failure)
+				return
+		else:
+			reportFailedDownload(institution, url, destination_directory, index, filename, disableFilenameReencode, report_failure)
+			return
 
-	filename = sanitisePath(filename)
-	total_file_name = os.path.abspath(sanitisePath(destination_directory) + "/" + filename)
-	total_file_name = createUniqueFilename(total_file_name)
-	if len(total_file_name) >= 255 and 'Windows' in platform.system():
-		dumpToOverflow(file_download_response.content, total_file_name)
-	else:
-		with open(total_file_name, 'wb') as outputFile:
-			outputFile.write(bytearray(file_download_response.content))
+	try:
+		filename = downloadFilename(file_download_response.headers, url, filename, index, disableFilenameReencode)
+
+		print('\tDownloaded', filename.encode('ascii', 'ignore'))
+		if not os.path.exists(destination_directory):
+			destination_directory = makeDirectories(destination_directory)
 
-	# Add sleep for rate limiting
-	delay()
+		filename = sanitisePath(filename)
+		total_file_name = os.path.abspath(sanitisePath(destination_directory) + "/" + filename)
+	except BaseException:
+		# saveDownload() normally hands the partial file back, but we didn't get that far.
+		file_download_response.close()
+		partialDownloadLock(partialDownloadPaths(download_url)[0]).release()
+		raise
+
+	saveDownload(download_url, file_download_response, offset, total_file_name)
 
 	return filename
 
-def doPostBack(page_url, postback_action, page_document, postback_parameter=None):
+def doPostBack(session, page_url, postback_action, page_document, postback_parameter=None):
 	postback_form = None
 	for form in page_document.forms:
 		if '__EVENTTARGET' in form.fields:
@@ -439,11 +1714,11 @@ def doPostBack(page_url, postback_action, page_document, postback_parameter=None
 	headers = {}
 	headers['Referer'] = page_url
 
-	messaging_response = session.post(page_url, headers=headers, data=post_data, allow_redirects=True)
+	messaging_response = Page(session.post(page_url, headers=headers, data=post_data, allow_redirects=True))
 
 	return messaging_response
 
-def loadPaginationPage(page_url, current_page_document, backpatch_character_index = 6):
+def loadPaginationPage(session, page_url, current_page_document, backpatch_character_index = 6):
 	next_page_button = current_page_document.find_class('previous-next')
 	found_next_button = False
 	for element in next_page_button:
@@ -465,16 +1740,16 @@ def loadPaginationPage(page_url, current_page_document, backpatch_character_inde
 	post_back_event[backpatch_character_index] = '$'
 	post_back_event = ''.join(post_back_event)
 
-	messaging_response = doPostBack(page_url, post_back_event, current_page_document)
+	messaging_response = doPostBack(session, page_url, post_back_event, current_page_document)
 
 	return True, messaging_response
 
 
 # --- DUMPING OF VARIOUS BITS OF ITS LEARNING FUNCTIONALITY ---
 
-def processTest(institution, pathThusFar, testURL, session):
-	test_response = session.get(testURL, allow_redirects = True)
-	test_document = fromstring(test_response.text)
+def processTest(institution, pathThusFar, testURL, session, is_unchanged=False):
+	test_response = fetchPage(session, testURL, allow_redirects = True)
+	test_document = test_response.document()
 	
 	test_title = test_document.find_class('ccl-pageheader')[0][0].text_content()
 	print('\tDownloading test/survey:', test_title.encode('ascii', 'ignore'))
@@ -486,16 +1761,18 @@ def processTest(institution, pathThusFar, testURL, session):
 	manualDumpDirectory = dumpDirectory + '/Explicit dump'
 	manualDumpDirectory = makeDirectories(manualDumpDirectory)
 
-	try:
-		# If we have access to downloading all results, we do so here.
-		# Since 'we can, grabbing both XLS and HTML reports.'
-		show_result_url = itslearning_root_url[institution] + test_document.get_element_by_id('result')[0].get('href')[2:]
-		download_file(institution, show_result_url + '&Type=2', dumpDirectory, session, disableFilenameReencode=False)
-		download_file(institution, show_result_url + '&Type=2&HtmlType=true', dumpDirectory, session, disableFilenameReencode=False)
-		print('\tIt\'s Learning generated report downloaded.')
-	except KeyError:
-		# No problem that we can't see the 'show result button, the manual dump will catch whatever is visible to us'
-		pass
+	# The reports are only downloaded again if the survey's entry in the folder changed
+	if not is_unchanged:
+		try:
+			# If we have access to downloading all results, we do so here.
+			# Since 'we can, grabbing both XLS and HTML reports.'
+			show_result_url = itslearning_root_url[institution] + test_document.get_element_by_id('result')[0].get('href')[2:]
+			download_file(institution, show_result_url + '&Type=2', dumpDirectory, session, disableFilenameReencode=False)
+			download_file(institution, show_result_url + '&Type=2&HtmlType=true', dumpDirectory, session, disableFilenameReencode=False)
+			print('\tIt\'s Learning generated report downloaded.')
+		except KeyError:
+			# No problem that we can't see the 'show result button, the manual dump will catch whatever is visible to us'
+			pass
 
 	pages_remaining = True
 	while pages_remaining:
@@ -523,23 +1800,24 @@ def processTest(institution, pathThusFar, testURL, session):
 				entry_url = None
 
 
-			if entry_url is not None:
+			if entry_url is not None and isItemUnchanged('survey-response', entry_url, entry_date):
+				print('\tResponse from', entry_name.encode('ascii', 'ignore'), 'has not changed since the previous dump, skipping.')
+			elif entry_url is not None:
 				print('\tDownloading response from', entry_name.encode('ascii', 'ignore'))
-				entry_response = session.get(entry_url, allow_redirects=True)
-				entry_document = fromstring(entry_response.text)
+				entry_response = fetchPage(session, entry_url, allow_redirects=True)
+				entry_document = entry_response.document()
 
 				file_content = convert_html_content(etree.tostring(entry_document.find_class('itsl-formbox')[0]).decode('utf-8')).encode('utf-8')
 
 				file_name = manualDumpDirectory + '/' + sanitiseFilename(entry_name) + ' ' + sanitiseFilename(entry_date) + output_text_extension
 				bytesToTextFile(file_content, file_name)
+				recordItem('survey-response', entry_url, entry_date)
 			else:
 				print('\tSkipping response from', entry_name.encode('ascii', 'ignore'), ': No response present or insufficient privileges.')
 
 
 			row_index += 1
 
-			delay()
-
 		# Searching for the next pagination button
 		# Of course this page has its own mechanism for this
 		next_page_button = test_document.find_class('previous-next')
@@ -557,12 +1835,12 @@ def processTest(institution, pathThusFar, testURL, session):
 		next_page_url = html.unescape(next_page_button[0].get('href'))[2:]
 
 		print('\tPage finished, moving on to next page.')
-		test_response = session.get(itslearning_root_url[institution] + next_page_url, allow_redirects = True)
-		test_document = fromstring(test_response.text)
+		test_response = fetchPage(session, itslearning_root_url[institution] + next_page_url, allow_redirects = True)
+		test_document = test_response.document()
 
 def processNote(institution, pathThusFar, noteURL, session):
-	note_response = session.get(noteURL, allow_redirects=True)
-	note_document = fromstring(note_response.text)
+	note_response = fetchPage(session, noteURL, allow_redirects=True)
+	note_document = note_response.document()
 
 	note_title_node = note_document.find_class('ccl-pageheader')[0]
 	note_title = sanitiseFilename(note_title_node[0].text_content())
@@ -584,14 +1862,14 @@ def processNote(institution, pathThusFar, noteURL, session):
 def processWeblink(institution, pathThusFar, weblinkPageURL, link_title, session):
 	print('\tDownloading weblink: ', link_title.encode('ascii', 'ignore'))
 
-	weblink_response = session.get(weblinkPageURL, allow_redirects=True)
-	weblink_document = fromstring(weblink_response.text)
+	weblink_response = fetchPage(session, weblinkPageURL, allow_redirects=True)
+	weblink_document = weblink_response.document()
 
 	header_frame = weblink_document.find(".//frame")
 	header_src = header_frame.get('src')
 
-	weblink_header_response = session.get(itslearning_weblink_header_base_url[institution] + header_src.split('=')[1], allow_redirects=True)
-	weblink_header_document = fromstring(weblink_header_response.text)
+	weblink_header_response = fetchPage(session, itslearning_weblink_header_base_url[institution] + header_src.split('=')[1], allow_redirects=True)
+	weblink_header_document = weblink_header_response.document()
 
 	link_info_node = weblink_header_document.find_class('frameheaderinfo')[0]
 	try:
@@ -607,8 +1885,8 @@ def processWeblink(institution, pathThusFar, weblinkPageURL, link_title, session
 	bytesToTextFile(link_file_content, pathThusFar + '/Link - ' + link_title + output_text_extension)
 
 def processLearningToolElement(institution, pathThusFar, elementURL, session):
-	element_response = session.get(elementURL, allow_redirects=True)
-	element_document = fromstring(element_response.text)
+	element_response = fetchPage(session, elementURL, allow_redirects=True)
+	element_document = element_response.document()
 
 	element_title = element_document.get_element_by_id('ctl00_PageHeader_TT').text
 	element_title = sanitiseFilename(element_title)
@@ -621,10 +1899,10 @@ def processLearningToolElement(institution, pathThusFar, elementURL, session):
 	try:
 		frameSrc = element_document.get_element_by_id('ctl00_ContentPlaceHolder_ExtensionIframe').get('src')
 
-		frame_content_response = session.get(frameSrc, allow_redirects=True)
+		frame_content_response = fetchPage(session, frameSrc, allow_redirects=True)
 		bytesToTextFile(frame_content_response.content, dumpDirectory + '/page_contents' + output_text_extension)
 
-		frame_content_document = fromstring(frame_content_response.text)
+		frame_content_document = frame_content_response.document()
 		for file_link in frame_content_document.find_class('file-link-link'):
 			link_href = file_link[0].get('href')
 			link_filename = file_link[0].get('download')
@@ -634,8 +1912,8 @@ def processLearningToolElement(institution, pathThusFar, elementURL, session):
 		bytesToTextFile(etree.tostring(element_document, pretty_print=True, encoding='utf-8'), dumpDirectory + '/page_contents' + output_text_extension)
 		
 def processCustomActivity(institution, pathThusFar, custom_activityURL, session):
-	custom_activity_response = session.get(custom_activityURL, allow_redirects=True)
-	custom_activity_document = fromstring(custom_activity_response.text)
+	custom_activity_response = fetchPage(session, custom_activityURL, allow_redirects=True)
+	custom_activity_document = custom_activity_response.document()
 
 	custom_activity_title = custom_activity_document.get_element_by_id('ctl00_PageHeader_TT').text
 	custom_activity_title = sanitiseFilename(custom_activity_title)
@@ -650,8 +1928,8 @@ def processCustomActivity(institution, pathThusFar, custom_activityURL, session)
 	bytesToTextFile(etree.tostring(custom_activity_ass, pretty_print=True, encoding='utf-8'), dumpDirectory + '/page_contents' + output_text_extension)
 
 def processPicture(institution, pathThusFar, pictureURL, session):
-	picture_response = session.get(pictureURL, allow_redirects=True)
-	picture_document = fromstring(picture_response.text)
+	picture_response = fetchPage(session, pictureURL, allow_redirects=True)
+	picture_document = picture_response.document()
 
 	element_title = picture_document.find_class('ccl-pageheader')[0].text_content()
 	element_title = sanitiseFilename(element_title)
@@ -667,28 +1945,24 @@ def processPicture(institution, pathThusFar, pictureURL, session):
 	description_text = etree.tostring(image_base_element[2], encoding='utf-8')
 	bytesToTextFile(description_text, dumpDirectoryPath + "/caption" + output_text_extension)
 
-def processDiscussionPost(institution, pathThusFar, postURL, postTitle, session):
+# Discussion threads are dumped in four stages: fetching the thread, parsing it, downloading its images, and writing it to disk.
+# The items passed between stages are tuples starting with the thread's URL.
+
+def fetchDiscussionPost(institution, postURL, postTitle, session):
 	print("\tDownloading thread:", postTitle.encode('ascii', 'ignore'))
-	post_response = session.get(postURL, allow_redirects=True)
-	post_document = fromstring(post_response.text)
+	post_response = fetchPage(thread_session(session), postURL, allow_redirects=True)
+	return [(postURL, postTitle, post_response)]
+
+def parseDiscussionPost(institution, postURL, postTitle, post_response):
+	post_document = post_response.document()
 
 	post_table_tag = post_document.find_class('threadViewTable')[0]
 	post_table_root = post_table_tag
 	if post_table_root[0].tag == 'tbody':
 			post_table_root = post_table_root[0]
 
-	postDumpDirectory = pathThusFar + '/Thread - ' + sanitiseFilename(postTitle)
-	completeDumpFile = postDumpDirectory
-	duplicateCount = 1
-	while os.path.exists(completeDumpFile):
-		if duplicateCount > 1:
-			completeDumpFile = postDumpDirectory + ' (Duplicate '+str(duplicateCount)+')'
-		else:
-			completeDumpFile = postDumpDirectory + ' (Duplicate)'
-		duplicateCount += 1
-	completeDumpFile = sanitisePath(completeDumpFile)
-
-	fileContents = ''
+	fileContents = []
+	image_URLs = []
 	tags_to_next_entry = 0
 
 	for index, post_tag in enumerate(post_table_root):
@@ -699,7 +1973,7 @@ def processDiscussionPost(institution, pathThusFar, postURL, postTitle, session)
 		
 		tags_to_next_entry = 2
 
-		fileContents += '-------------------------------------------------------------------------\n'
+		fileContents.append('-------------------------------------------------------------------------\n')
 
 		post_contents_tag = post_tag.getnext()
 
@@ -721,10 +1995,6 @@ def processDiscussionPost(institution, pathThusFar, postURL, postTitle, session)
 
 		# Also download any images shown in the post
 		for image_tag in post_contents_tag[0][0].iterfind(".//img"):
-			imageDumpDirectory = pathThusFar + '/Attachments'
-			if not os.path.exists(imageDumpDirectory):
-				imageDumpDirectory = makeDirectories(imageDumpDirectory)
-
 			image_URL = image_tag.get('src')
 
 			# For some reason there can be images containing nothing on a page. No idea why.
@@ -735,25 +2005,76 @@ def processDiscussionPost(institution, pathThusFar, postURL, postTitle, session)
 			if not image_URL.startswith('http'):
 				image_URL = itslearning_root_url[institution] + image_URL
 
-			download_file(institution, image_URL, imageDumpDirectory, session)
-
-			delay()
+			image_URLs.append(image_URL)
 
 		if not is_post_deleted:
 			timestamp = footer_tag[0][0][0].text.strip()
 		else:
 			timestamp = ''
 
-		fileContents += author + '\n' + timestamp + '\n\n' + post_content + '\n\n'
+		fileContents.append(author + '\n' + timestamp + '\n\n' + post_content + '\n\n')
 
-	bytesToTextFile(fileContents.encode('utf-8'), completeDumpFile + output_text_extension)
+	return [(postURL, postTitle, ''.join(fileContents), image_URLs)]
 
-	# Add a time delay before moving on to the next post
-	delay()
+def downloadDiscussionPostImages(institution, pathThusFar, postURL, postTitle, fileContents, image_URLs, session):
+	for image_URL in image_URLs:
+		imageDumpDirectory = pathThusFar + '/Attachments'
+		if not os.path.exists(imageDumpDirectory):
+			imageDumpDirectory = makeDirectories(imageDumpDirectory)
 
-def processDiscussionForum(institution, pathThusFar, discussionURL, session):
-	discussion_response = session.get(discussionURL, allow_redirects=True)
-	discussion_document = fromstring(discussion_response.text)
+		download_file(institution, image_URL, imageDumpDirectory, thread_session(session))
+	return [(postURL, postTitle, fileContents)]
+
+def writeDiscussionPost(pathThusFar, postURL, postTitle, fileContents, post_fingerprint=None):
+	postDumpDirectory = pathThusFar + '/Thread - ' + sanitiseFilename(postTitle)
+	completeDumpFile = postDumpDirectory
+	duplicateCount = 1
+	while os.path.exists(completeDumpFile):
+		if duplicateCount > 1:
+			completeDumpFile = postDumpDirectory + ' (Duplicate '+str(duplicateCount)+')'
+		else:
+			completeDumpFile = postDumpDirectory + ' (Duplicate)'
+		duplicateCount += 1
+	completeDumpFile = sanitisePath(completeDumpFile)
+
+	bytesToTextFile(fileContents.encode('utf-8'), completeDumpFile + output_text_extension)
+	if post_fingerprint is not None:
+		recordItem('discussion-post', postURL, post_fingerprint)
+
+# Every stage passes on the URL and title of the post first
+def reportDiscussionPostCrash(institution, pathThusFar, item, error_information, post_fingerprint=None):
+	with console_lock:
+		print('\n\nSTART OF ERROR INFORMATION\n\n\n\n')
+		print(error_information)
+		print('\n\n\n\nEND OF ERROR INFORMATION')
+		print()
+		print('Oh no! The script crashed while trying to download the following discussion post:')
+		print(item[0].encode('ascii', 'ignore'))
+		print('Some information regarding the error is shown above.')
+		print('Please mail a screenshot of this information to bart.van.blokland@ntnu.no, and I can see if I can help you fix it.')
+		printSkipNotice()
+	recordFailure('discussion post', error_information, institution=institution, path=pathThusFar, url=item[0], title=item[1], fingerprint=post_fingerprint)
+
+# Used when retrying a single post; the stages of the pipeline are run one after the other.
+def dumpDiscussionPost(institution, pathThusFar, postURL, postTitle, session, post_fingerprint=None):
+	for fetched_post in fetchDiscussionPost(institution, postURL, postTitle, session):
+		for parsed_post in parseDiscussionPost(institution, *fetched_post):
+			for post in downloadDiscussionPostImages(institution, pathThusFar, *parsed_post, session):
+				writeDiscussionPost(pathThusFar, *post, post_fingerprint)
+
+# Starts 2 * fetch_worker_count + 2 threads. The clones of the session they use share its cookies and connections, so they are cheap to make.
+# Posts are recorded in the manifest with the fingerprint of their row in the forum (post URL -> fingerprint), once they are written.
+def createDiscussionPostPipeline(institution, discussionDumpDirectory, session, post_fingerprints):
+	return Pipeline([
+		(lambda item: fetchDiscussionPost(institution, *item, session), fetch_worker_count),
+		(lambda item: parseDiscussionPost(institution, *item), 1),
+		(lambda item: downloadDiscussionPostImages(institution, discussionDumpDirectory, *item, session), fetch_worker_count),
+		(lambda item: writeDiscussionPost(discussionDumpDirectory, *item, post_fingerprints.get(item[0])), 1)],
+		lambda item, error_information: reportDiscussionPostCrash(institution, discussionDumpDirectory, item, error_information, post_fingerprints.get(item[0])))
+
+def processDiscussionForum(institution, pathThusFar, discussionURL, session, is_unchanged=False):
+	discussion_response = fetchPage(session, discussionURL, allow_redirects=True)
+	discussion_document = discussion_response.document(postback=True)
 
 	# They are sooo inconsistent with these conventions.
 	discussion_title = sanitiseFilename(discussion_document.get_element_by_id('ctl05_TT').text)
@@ -772,60 +2093,60 @@ def processDiscussionForum(institution, pathThusFar, discussionURL, session):
 	threadID = 1
 	pages_remaining = True
 
-	# Pagination
-	while pages_remaining:
+	# Started once the first thread is found, so forums without any threads don't start a pipeline for nothing
+	post_pipeline = None
+	post_fingerprints = {}
 
-		nextThreadElement = discussion_document.get_element_by_id('Threads_' + str(threadID))
-		if nextThreadElement[0].text is None or (not nextThreadElement[0].text.startswith('No threads') and not nextThreadElement[0].text.startswith('Inga trådar')):
-			while nextThreadElement is not None and nextThreadElement != False:
-				postURL = nextThreadElement[1][0].get('href')
-				postTitle = nextThreadElement[1][0].text
-				try:
-					processDiscussionPost(institution, discussionDumpDirectory, itslearning_root_url[institution] + postURL, postTitle, session)
-				except Exception:
-					print('\n\nSTART OF ERROR INFORMATION\n\n\n\n')
-					traceback.print_exc()
-					print('\n\n\n\nEND OF ERROR INFORMATION')
-					print()
-					print('Oh no! The script crashed while trying to download the following discussion post:')
-					print((itslearning_root_url[institution] + postURL).encode('ascii', 'ignore'))
-					print('Some information regarding the error is shown above.')
-					print('Please mail a screenshot of this information to bart.van.blokland@ntnu.no, and I can see if I can help you fix it.')
-					print('Would you like to skip this item and move on?')
-					print('Type \'skip\' if you\'d like to skip this element and continue downloading any remaining elements, or anything else if you\'d like to abort the download.')
-					decision = input('Skip this element? ')
-					if decision != 'skip':
-						print('Download has been aborted.')
-						sys.exit(0)
-				threadID += 1
-				try:
-					nextThreadElement = discussion_document.get_element_by_id('Threads_' + str(threadID))
-				except KeyError:
-					nextThreadElement = False
-		else:
-			bytesToTextFile('No threads were created in this forum.'.encode('utf-8'), discussionDumpDirectory + '/No threads.txt')
+	try:
+		# Pagination
+		while pages_remaining:
 
-		# Move on to next page
-		found_next_page, discussion_response = loadPaginationPage(discussionURL, discussion_document, backpatch_character_index=7)
+			nextThreadElement = discussion_document.get_element_by_id('Threads_' + str(threadID))
+			if nextThreadElement[0].text is None or (not nextThreadElement[0].text.startswith('No threads') and not nextThreadElement[0].text.startswith('Inga trådar')):
+				while nextThreadElement is not None and nextThreadElement != False:
+					postURL = itslearning_root_url[institution] + nextThreadElement[1][0].get('href')
+					postTitle = nextThreadElement[1][0].text
+					# The row of a thread shows its number of replies and when the last one was posted
+					post_fingerprint = ' '.join(nextThreadElement.text_content().split())
+					if isItemUnchanged('discussion-post', postURL, post_fingerprint):
+						print('\tThread has not changed since the previous dump, skipping:', postTitle.encode('ascii', 'ignore'))
+					else:
+						if post_pipeline is None:
+							post_pipeline = createDiscussionPostPipeline(institution, discussionDumpDirectory, session, post_fingerprints)
+						post_fingerprints[postURL] = post_fingerprint
+						post_pipeline.put((postURL, postTitle))
+					threadID += 1
+					try:
+						nextThreadElement = discussion_document.get_element_by_id('Threads_' + str(threadID))
+					except KeyError:
+						nextThreadElement = False
+			elif not is_unchanged:
+				bytesToTextFile('No threads were created in this forum.'.encode('utf-8'), discussionDumpDirectory + '/No threads.txt')
 
-		if found_next_page:
-			discussion_document = fromstring(discussion_response.text)
-			# Start at the first thread on the next page
-			threadID = 1
-		else:
-			pages_remaining = False
+			# Move on to next page
+			found_next_page, discussion_response = loadPaginationPage(session, discussionURL, discussion_document, backpatch_character_index=7)
+
+			if found_next_page:
+				discussion_document = discussion_response.document(postback=True)
+				# Start at the first thread on the next page
+				threadID = 1
+			else:
+				pages_remaining = False
+	finally:
+		if post_pipeline is not None:
+			post_pipeline.close()
 
 
 
-def processAssignment(institution, pathThusFar, assignmentURL, session):
+def processAssignment(institution, pathThusFar, assignmentURL, session, is_unchanged=False):
 	print("\tDownloading assignment:", assignmentURL.encode('ascii', 'ignore'))
-	assignment_response = session.get(assignmentURL, allow_redirects=True)
+	assignment_response = fetchPage(session, assignmentURL, allow_redirects=True)
 
 	if itslearning_unauthorized_url[institution] in assignment_response.url:
 		print('\t Access denied. Skipping.')
 		return
 
-	assignment_document = fromstring(assignment_response.text)
+	assignment_document = assignment_response.document(postback=True)
 	#writeHTML(assignment_document, 'output.html')
 
 	assignment_title = assignment_document.get_element_by_id('ctl05_TT').text
@@ -836,83 +2157,85 @@ def processAssignment(institution, pathThusFar, assignmentURL, session):
 
 	assignment_answer_table = assignment_document.find_class('itsl-assignment-answer')
 	
-	# Download the assignment description
-	details_sidebar_element = assignment_document.find_class('ccl-rwgm-column-1-3')[0]
-	description_element = assignment_document.find_class('ccl-rwgm-column-2-3')[0]
+	# Only the submissions are checked for changes if the assignment itself is unchanged
+	if not is_unchanged:
+		# Download the assignment description
+		details_sidebar_element = assignment_document.find_class('ccl-rwgm-column-1-3')[0]
+		description_element = assignment_document.find_class('ccl-rwgm-column-2-3')[0]
 
-	assignment_description = convert_html_content(etree.tostring(description_element[1], encoding='utf-8').decode('utf-8'))
+		assignment_description = convert_html_content(etree.tostring(description_element[1], encoding='utf-8').decode('utf-8'))
 	
-	details_element = details_sidebar_element[1]
-	assignment_details = ''
+		details_element = details_sidebar_element[1]
+		assignment_details = ''
 
-	for element in details_element:
-		# Just dump the table on the right sidebar as-is
-		assignment_details += ' '.join(convert_html_content(element.text_content()).split('\n')).strip() + '\n'
+		for element in details_element:
+			# Just dump the table on the right sidebar as-is
+			assignment_details += ' '.join(convert_html_content(element.text_content()).split('\n')).strip() + '\n'
 
-	assignment_details += '\nTask description:\n\n' + assignment_description
+		assignment_details += '\nTask description:\n\n' + assignment_description
 
-	bytesToTextFile(assignment_details.encode('utf-8'), dumpDirectory + '/Assignment description' + output_text_extension)
+		bytesToTextFile(assignment_details.encode('utf-8'), dumpDirectory + '/Assignment description' + output_text_extension)
 
-	# Download assignment description files
-	file_listing_element = description_element[2][1]
-	for file_element in file_listing_element:
-		file_url = file_element[0].get('href')
-		download_file(institution, file_url, dumpDirectory, session)
+		# Download assignment description files
+		file_listing_element = description_element[2][1]
+		for file_element in file_listing_element:
+			file_url = file_element[0].get('href')
+			download_file(institution, file_url, dumpDirectory, session)
 
 
-	# Download own submission, but only if assignment was answered
-	if assignment_answer_table:
-		answerDumpDirectory = dumpDirectory + '/Own answer'
-		answerDumpDirectory = makeDirectories(answerDumpDirectory)
+		# Download own submission, but only if assignment was answered
+		if assignment_answer_table:
+			answerDumpDirectory = dumpDirectory + '/Own answer'
+			answerDumpDirectory = makeDirectories(answerDumpDirectory)
 
-		# For some reason not all answers have a tbody tag.
-		assignment_answer_root = assignment_answer_table[0]
-		if assignment_answer_root[0].tag == 'tbody':
-			assignment_answer_root = assignment_answer_root[0]
+			# For some reason not all answers have a tbody tag.
+			assignment_answer_root = assignment_answer_table[0]
+			if assignment_answer_root[0].tag == 'tbody':
+				assignment_answer_root = assignment_answer_root[0]
 
-		assessment_file_contents = ''.encode('utf-8')
+			assessment_file_contents = ''.encode('utf-8')
 
 
-		# Part 1: The table describing when you submitted, who evaluated you, etc
-		baseInformationTable = assignment_answer_table[0].getprevious()
-		while not baseInformationTable.tag == 'table':
-			baseInformationTable = baseInformationTable.getprevious()
-		if baseInformationTable[0].tag == 'tbody':
-			baseInformationTable = baseInformationTable[0]
-		for entry in baseInformationTable:
-			if entry is None or entry[0] is None or entry[0].text is None:
-				continue
-			assessment_file_contents += (entry[0].text + ': ').encode('utf-8') + etree.tostring(entry[1], encoding='utf-8') + '\n'.encode('utf-8')
+			# Part 1: The table describing when you submitted, who evaluated you, etc
+			baseInformationTable = assignment_answer_table[0].getprevious()
+			while not baseInformationTable.tag == 'table':
+				baseInformationTable = baseInformationTable.getprevious()
+			if baseInformationTable[0].tag == 'tbody':
+				baseInformationTable = baseInformationTable[0]
+			for entry in baseInformationTable:
+				if entry is None or entry[0] is None or entry[0].text is None:
+					continue
+				assessment_file_contents += (entry[0].text + ': ').encode('utf-8') + etree.tostring(entry[1], encoding='utf-8') + '\n'.encode('utf-8')
 
 
-		# Part 2: The table containing your submitted files and feedback
-		for entry in assignment_answer_root:
+			# Part 2: The table containing your submitted files and feedback
+			for entry in assignment_answer_root:
 
-			if entry is None or entry[0] is None or entry[0].text is None:
-				continue		
+				if entry is None or entry[0] is None or entry[0].text is None:
+					continue		
 
-			if entry[0].text.startswith('Files') or entry[0].text.startswith('Filer'):
-				file_list_div = entry[1][0]
-				for index, file_entry in enumerate(file_list_div):
-					if file_entry.tag == 'section':
-						continue
-					if len(file_entry) == 0:
-						continue
+				if entry[0].text.startswith('Files') or entry[0].text.startswith('Filer'):
+					file_list_div = entry[1][0]
+					for index, file_entry in enumerate(file_list_div):
+						if file_entry.tag == 'section':
+							continue
+						if len(file_entry) == 0:
+							continue
 
-					file_index = None
-					if len(file_list_div) > 2:
-						file_index = index
+						file_index = None
+						if len(file_list_div) > 2:
+							file_index = index
 
-					file_location = file_entry[0][0].get('href')
-					download_file(institution, file_location, answerDumpDirectory, session, file_index)
-			else:
-				for attached_file in entry.find_class('ccl-iconlink'):
-					file_location = attached_file.get('href')
-					download_file(institution, file_location, answerDumpDirectory, session)
-				assessment_file_contents += (entry[0].text + ': ').encode('utf-8') + etree.tostring(entry[1], encoding='utf-8') + '\n'.encode('utf-8')
+						file_location = file_entry[0][0].get('href')
+						download_file(institution, file_location, answerDumpDirectory, session, file_index)
+				else:
+					for attached_file in entry.find_class('ccl-iconlink'):
+						file_location = attached_file.get('href')
+						download_file(institution, file_location, answerDumpDirectory, session)
+					assessment_file_contents += (entry[0].text + ': ').encode('utf-8') + etree.tostring(entry[1], encoding='utf-8') + '\n'.encode('utf-8')
 
 
-		bytesToTextFile(assessment_file_contents, answerDumpDirectory + '/assessment.html')
+			bytesToTextFile(assessment_file_contents, answerDumpDirectory + '/assessment.html')
 
 	filter_box_present = True
 	try:
@@ -936,8 +2259,8 @@ def processAssignment(institution, pathThusFar, assignmentURL, session):
 				if form_input_name.startswith('EssayAnswers$ctl00$groupFilter'):
 					postback_form.inputs[form_input_name].checked = True
 			# And do a postback to get a page with no filters applied
-			postback_response = doPostBack(assignmentURL, 'EssayAnswers$ctl00$groupFilter', assignment_document, postback_parameter='filter')
-			assignment_document = fromstring(postback_response.text)
+			postback_response = doPostBack(session, assignmentURL, 'EssayAnswers$ctl00$groupFilter', assignment_document, postback_parameter='filter')
+			assignment_document = postback_response.document(postback=True)
 
 	answers_submitted = True
 	try:
@@ -956,182 +2279,220 @@ def processAssignment(institution, pathThusFar, assignmentURL, session):
 		student_submissions = dumpDirectory + '/Student answers'
 		student_submissions = makeDirectories(student_submissions)
 
-		# Index 0 is the table header, which we skip
+		# The submissions on a page are read into a list first, and then downloaded by a pool of workers.
+		# Meanwhile, the next page is already being requested.
+		with ThreadPoolExecutor(max_workers=fetch_worker_count) as submission_pool, ThreadPoolExecutor(max_workers=1) as page_pool:
+			pages_remaining = True
+			while pages_remaining:
+				submissions = readSubmissionTable(institution, assignmentURL, assignment_document)
 
-		pages_remaining = True
-		while pages_remaining:
-			submission_index = 1
-			answers_remaining = True
-			while answers_remaining:
-				try:
-					submission_element = assignment_document.get_element_by_id('EssayAnswers_{}'.format(submission_index))
-				except KeyError:
-					# End the loop when there are no more submissions
+				# The postback modifies the document, but we're done reading from it
+				next_page = page_pool.submit(loadNextSubmissionPage, session, assignmentURL, assignment_document)
 
-					answers_remaining = False
-					continue
+				submission_downloads = [submission_pool.submit(withWriteScope(dumpSubmission), institution, assignmentURL, student_submissions, submission, session) for submission in submissions]
+				for submission_download in submission_downloads:
+					submission_download.result()
 
-				#for i in range(0, 10):
-				#	try: 
-				#		print(i, ':', etree.tostring(submission_element[i]))
-				#	except IndexError:
-				#		pass
+				# Move on to the next page
+				found_next_page, assignment_response = next_page.result()
 
-				no_group_index_offset = 1
+				if found_next_page:
+					assignment_document = assignment_response.document(postback=True)
+				else:
+					pages_remaining = False
 
-				#Dirty code: Enable this if your site doesn't have an extra column between name and submitted time
-				#no_group_index_offset = 0
+def loadNextSubmissionPage(session, assignmentURL, assignment_document):
+	return loadPaginationPage(thread_session(session), assignmentURL, assignment_document, backpatch_character_index=12)
 
+def readSubmissionRow(institution, submission_element):
+	#for i in range(0, 10):
+	#	try: 
+	#		print(i, ':', etree.tostring(submission_element[i]))
+	#	except IndexError:
+	#		pass
 
+	no_group_index_offset = 1
 
-				#print("Index offset:", no_group_index_offset)
+	#Dirty code: Enable this if your site doesn't have an extra column between name and submitted time
+	#no_group_index_offset = 0
 
-				# Exploits that solution links have no text with coloured highlighting
-				try:
-					plagiarism_text_element = submission_element[6 + no_group_index_offset][0]
-					has_plagiarism_report = plagiarism_text_element.get('class') is not None and ('colorbox' in plagiarism_text_element.get('class') or 'h-hidden' in plagiarism_text_element.get('class'))
-				except IndexError:
-					has_plagiarism_report = False
 
-				plagiarism_index_offset = 0
-				if has_plagiarism_report:
-					plagiarism_index_offset = 1
-				score_index_offset = 1
 
-				#print('plagiarism offset:', plagiarism_index_offset)
+	#print("Index offset:", no_group_index_offset)
 
+	# Exploits that solution links have no text with coloured highlighting
+	try:
+		plagiarism_text_element = submission_element[6 + no_group_index_offset][0]
+		has_plagiarism_report = plagiarism_text_element.get('class') is not None and ('colorbox' in plagiarism_text_element.get('class') or 'h-hidden' in plagiarism_text_element.get('class'))
+	except IndexError:
+		has_plagiarism_report = False
 
-				# Column 0: Checkbox
-				# Column 1: Student names
-				try:
-					students = [link[0].text for link in submission_element[1].find_class('ccl-iconlink')]
-				except Exception:
-					students = [submission_element[1].text_content()]
-				if not students:
-					students = [submission_element[1].text_content()]
-				# Column 2: synckey
-				synckey = submission_element[1 + no_group_index_offset].text
-				# Column 3: Submission time
-				submission_time = submission_element[2 + no_group_index_offset].text_content()
-				# Column 4: Review Date
-				review_date = submission_element[3 + no_group_index_offset].text
-				# Column 4: Status
-				status = submission_element[4 + no_group_index_offset].text_content()
-				# Column 5: Score
-				# If nobody answered the assignment, all of the next elements are not present and thus will fail
+	plagiarism_index_offset = 0
+	if has_plagiarism_report:
+		plagiarism_index_offset = 1
+	score_index_offset = 1
 
-				try:
-					if submission_element[5 + no_group_index_offset].text != None or submission_element[5 + no_group_index_offset].text != '':
-						score = submission_element[5 + no_group_index_offset].text
-					else:
-						# We have hit the assignment details link. This requires adjusting the offset
-						score_index_offset = 0
-						score = None
-
-				except IndexError:
-					score = None
-				# Column 6: Plagiarism status
-				if has_plagiarism_report:
-					try:
-						plagiarism_status = submission_element[5 + no_group_index_offset].text_content()
-					except IndexError:
-						plagiarism_status = None
-				else:
-					plagiarism_status = None
-				# Column 7: Show (link to details page)
-				try:
-					# Exploit that the last entry is always the details link
-					details_page_url = itslearning_root_url[institution] + submission_element[len(submission_element) - 1][0].get('href')
-				except IndexError:
-					details_page_url = None
+	#print('plagiarism offset:', plagiarism_index_offset)
 
-				has_submitted = submission_time is not None and not 'Not submitted' in submission_time and not 'Ikke levert' in submission_time
-				if submission_time is None or submission_time == 'Not submitted':
-					submission_time = 'Not submitted.'
-				if review_date is None or review_date == '':
-					review_date = 'Not assessed.'
-				if score is None:
-					score = ''
-				if plagiarism_status is None:
-					plagiarism_status = 'No plagiarism check has been done.'
 
+	# Column 0: Checkbox
+	# Column 1: Student names
+	try:
+		students = [link[0].text for link in submission_element[1].find_class('ccl-iconlink')]
+	except Exception:
+		students = [submission_element[1].text_content()]
+	if not students:
+		students = [submission_element[1].text_content()]
+	# Column 2: synckey
+	synckey = submission_element[1 + no_group_index_offset].text
+	# Column 3: Submission time
+	submission_time = submission_element[2 + no_group_index_offset].text_content()
+	# Column 4: Review Date
+	review_date = submission_element[3 + no_group_index_offset].text
+	# Column 4: Status
+	status = submission_element[4 + no_group_index_offset].text_content()
+	# Column 5: Score
+	# If nobody answered the assignment, all of the next elements are not present and thus will fail
 
-				print('\tDownloading assignment submission ', students[0].encode('ascii', 'ignore'))
+	try:
+		if submission_element[5 + no_group_index_offset].text != None or submission_element[5 + no_group_index_offset].text != '':
+			score = submission_element[5 + no_group_index_offset].text
+		else:
+			# We have hit the assignment details link. This requires adjusting the offset
+			score_index_offset = 0
+			score = None
 
-				comment_field_contents = ''
-				details_page_content = None
+	except IndexError:
+		score = None
+	# Column 6: Plagiarism status
+	if has_plagiarism_report:
+		try:
+			plagiarism_status = submission_element[5 + no_group_index_offset].text_content()
+		except IndexError:
+			plagiarism_status = None
+	else:
+		plagiarism_status = None
+	# Column 7: Show (link to details page)
+	try:
+		# Exploit that the last entry is always the details link
+		details_page_url = itslearning_root_url[institution] + submission_element[len(submission_element) - 1][0].get('href')
+	except IndexError:
+		details_page_url = None
+
+	has_submitted = submission_time is not None and not 'Not submitted' in submission_time and not 'Ikke levert' in submission_time
+	if submission_time is None or submission_time == 'Not submitted':
+		submission_time = 'Not submitted.'
+	if review_date is None or review_date == '':
+		review_date = 'Not assessed.'
+	if score is None:
+		score = ''
+	if plagiarism_status is None:
+		plagiarism_status = 'No plagiarism check has been done.'
+
+	return students, synckey, submission_time, review_date, status, score, details_page_url, has_submitted
+
+def readSubmissionTable(institution, assignmentURL, assignment_document):
+	# Index 0 is the table header, which we skip
+	submissions = []
+	submission_index = 1
+	while True:
+		try:
+			submission_element = assignment_document.get_element_by_id('EssayAnswers_{}'.format(submission_index))
+		except KeyError:
+			# End the loop when there are no more submissions
+			return submissions
+		submission_index += 1
+
+		submission = readSubmissionRow(institution, submission_element)
+		students = submission[0]
+		if isCompleted('submission', assignmentURL + ' ' + ', '.join(students)):
+			print('\tSkipping submission to resume from saved state:', students[0].encode('ascii', 'ignore'))
+			continue
+		if isItemUnchanged('submission', assignmentURL + ' ' + ', '.join(students), submissionFingerprint(submission)):
+			print('\tSubmission has not changed since the previous dump, skipping:', students[0].encode('ascii', 'ignore'))
+			continue
+		submissions.append(submission)
 
-				# Only download solution if one was submitted
-				if has_submitted:
-					details_page_response = session.get(details_page_url, allow_redirects = True)
-					details_page_content = fromstring(details_page_response.content)
+# A submission changes when it is handed in again or assessed
+def submissionFingerprint(submission):
+	students, synckey, submission_time, review_date, status, score, details_page_url, has_submitted = submission
+	return ' '.join([synckey, submission_time, review_date, status, score])
 
-					assessment_form_element = details_page_content.get_element_by_id('AssessForm')
+def dumpSubmission(institution, assignmentURL, student_submissions, submission, session):
+	students, synckey, submission_time, review_date, status, score, details_page_url, has_submitted = submission
+	session = thread_session(session)
 
-					comment_field_element = assessment_form_element.get_element_by_id('AssessForm_comments_EditorCKEditor_ctl00')
-					comment_field_contents = convert_html_content(etree.tostring(comment_field_element).decode('utf-8'))
-				
-				answer_directory = student_submissions + '/' + sanitiseFilename(students[0])
-				answer_directory = makeDirectories(answer_directory)
-
-				# Write out assessment details to a file
-				answer_info = 'Students:\n'
-				for student in students:
-					answer_info += '\t- ' + student + '\n'
-				answer_info += 'Sync key: ' + synckey + '\n'
-				answer_info += 'Submitted: ' + submission_time + '\n'
-				answer_info += 'Review Date: ' + review_date + '\n'
-				answer_info += 'Reviewed: ' + status + '\n'
-				answer_info += 'Score: ' + score + '\n'
-				#answer_info += 'Plagiarism status: ' + plagiarism_status + '\n'
-				answer_info += 'Comments on assessment: \n\n' + comment_field_contents + '\n'
-
-				bytesToTextFile(answer_info.encode('utf-8'), answer_directory + '/Answer' + output_text_extension)
-
-				# Again, only download files if there is a submission in the first place.
-				if has_submitted:
-					# Case 1: A plagiarism check was performed
-					has_checked_files = True
-					try:
-						file_listing_element = assessment_form_element.find_class('tablelisting')[0][0]
-					except IndexError:
-						has_checked_files = False
-					if has_checked_files:
-						for link in file_listing_element.iterlinks():
-							# We only want URLs for files.
-							# Contrary to what it might seem iterlinks iterates over anything with an external URL in it.
-							if not link[0].tag == 'a':
-								continue
-							# We also don't want plagiarism reports
-							if '/essay/PlagiarismReport.aspx' in link[2]:
-								continue
-							download_file(institution, link[2], answer_directory, session, filename=html.unescape(link[0].text_content()), disableFilenameReencode=True)
-					
-					# Case 2: No plagiarism check was performed
-					has_unchecked_files = True
-					try:
-						file_listing_element = assessment_form_element.get_element_by_id('AssessForm_ctl02_FileList')[1]
-					except KeyError:
-						has_unchecked_files = False
-					if has_unchecked_files:
-						for link_element in file_listing_element:
-							download_file(institution, link_element[0].get('href'), answer_directory, session, filename=html.unescape(link_element[0].text_content()), disableFilenameReencode=True)
+	print('\tDownloading assignment submission ', students[0].encode('ascii', 'ignore'))
 
+	comment_field_contents = ''
+	details_page_content = None
 
-				
-				submission_index += 1
+	# Only download solution if one was submitted
+	if has_submitted:
+		details_page_response = fetchPage(session, details_page_url, allow_redirects = True)
+		details_page_content = details_page_response.document(from_bytes=True)
 
-			# Move on to the next page
-			found_next_page, assignment_response = loadPaginationPage(assignmentURL, assignment_document, backpatch_character_index=12)
+		assessment_form_element = details_page_content.get_element_by_id('AssessForm')
 
-			if found_next_page:
-				assignment_document = fromstring(assignment_response.text)
-			else:
-				pages_remaining = False
-
-def processOnlineTestAttempt(institution, session, details_URL, dumpDirectory, attempt_index, student_name, attempt_file_contents):
-	details_page_response = session.get(itslearning_root_url[institution] + details_URL, allow_redirects=True)
-	details_page_document = fromstring(details_page_response.text)
+		comment_field_element = assessment_form_element.get_element_by_id('AssessForm_comments_EditorCKEditor_ctl00')
+		comment_field_contents = convert_html_content(etree.tostring(comment_field_element).decode('utf-8'))
+	
+	answer_directory = student_submissions + '/' + sanitiseFilename(students[0])
+	answer_directory = makeDirectories(answer_directory)
+
+	# Write out assessment details to a file
+	answer_info = ['Students:\n']
+	for student in students:
+		answer_info.append('\t- ' + student + '\n')
+	answer_info.append('Sync key: ' + synckey + '\n')
+	answer_info.append('Submitted: ' + submission_time + '\n')
+	answer_info.append('Review Date: ' + review_date + '\n')
+	answer_info.append('Reviewed: ' + status + '\n')
+	answer_info.append('Score: ' + score + '\n')
+	#answer_info.append('Plagiarism status: ' + plagiarism_status + '\n')
+	answer_info.append('Comments on assessment: \n\n' + comment_field_contents + '\n')
+
+	bytesToTextFile(''.join(answer_info).encode('utf-8'), answer_directory + '/Answer' + output_text_extension)
+	exportRecord('submission', assignmentURL + ' ' + ', '.join(students), institution=institution, assignment=assignmentURL, path=answer_directory, students=students, synckey=synckey, submitted=submission_time, review_date=review_date, status=status, score=score, comments=comment_field_contents)
+
+	# Again, only download files if there is a submission in the first place.
+	if has_submitted:
+		# Case 1: A plagiarism check was performed
+		has_checked_files = True
+		try:
+			file_listing_element = assessment_form_element.find_class('tablelisting')[0][0]
+		except IndexError:
+			has_checked_files = False
+		if has_checked_files:
+			for link in file_listing_element.iterlinks():
+				# We only want URLs for files.
+				# Contrary to what it might seem iterlinks iterates over anything with an external URL in it.
+				if not link[0].tag == 'a':
+					continue
+				# We also don't want plagiarism reports
+				if '/essay/PlagiarismReport.aspx' in link[2]:
+					continue
+				download_file(institution, link[2], answer_directory, session, filename=html.unescape(link[0].text_content()), disableFilenameReencode=True)
+		
+		# Case 2: No plagiarism check was performed
+		has_unchecked_files = True
+		try:
+			file_listing_element = assessment_form_element.get_element_by_id('AssessForm_ctl02_FileList')[1]
+		except KeyError:
+			has_unchecked_files = False
+		if has_unchecked_files:
+			for link_element in file_listing_element:
+				download_file(institution, link_element[0].get('href'), answer_directory, session, filename=html.unescape(link_element[0].text_content()), disableFilenameReencode=True)
+
+	recordItem('submission', assignmentURL + ' ' + ', '.join(students), submissionFingerprint(submission))
+	markCompleted('submission', assignmentURL + ' ' + ', '.join(students))
+
+def fetchQuestionPage(question_link, session):
+	return fetchPage(thread_session(session), question_link, allow_redirects=True)
+
+def processOnlineTestAttempt(institution, session, details_URL, dumpDirectory, attempt_index, student_name, attempt_file_contents, question_pool):
+	details_page_response = fetchPage(session, itslearning_root_url[institution] + details_URL, allow_redirects=True)
+	details_page_document = details_page_response.document(postback=True)
 	
 	attempt_file_contents += '\n'
 
@@ -1157,16 +2518,20 @@ def processOnlineTestAttempt(institution, session, details_URL, dumpDirectory, a
 	attemptDirectory = makeDirectories(attemptDirectory)
 
 	while len(question_table_body) > 0:
+		# All questions on the page are requested at once, and then saved in order as they come in
+		questions = []
 		for question_element in question_table_body:
-			print('\tSaving question', question_index)
 			question_link = itslearning_root_url[institution] + question_element[0][1].get('href')
-			
-			question_title = question_element[1].text_content()
+			questions.append((question_element[1].text_content(), question_pool.submit(fetchQuestionPage, question_link, session)))
+
+		for question_title, question_page in questions:
+			print('\tSaving question', question_index)
 			attempt_file_contents += 'Question ' + str(question_index) + ': ' + question_title + '\n\n'
 			
-			question_response = session.get(question_link, allow_redirects=True)
-			question_document = fromstring(question_response.text)
+			question_response = question_page.result()
+			question_document = question_response.document()
 
+			question_result = None
 			try:
 				question_result = question_document.find_class('question-result')[0].text_content()
 				attempt_file_contents += question_result + '\n'
@@ -1174,19 +2539,24 @@ def processOnlineTestAttempt(institution, session, details_URL, dumpDirectory, a
 				# Sometimes the score can be missing. This is a workaround so at least the script can continue.
 				pass
 
+			question_options = None
 			try:
 				question_options_table = question_document.get_element_by_id('qti-choiceinteraction-container')
 
+				question_options = []
 				for option_index, question_options_row in enumerate(question_options_table):
 					if option_index == 0:
 						attempt_file_contents += question_options_row.text_content() + '\n'
 						continue
 					if question_options_row.get('class') is not None and 'checkedrow' in question_options_row.get('class'):
 						attempt_file_contents += 'Option (selected): ' + question_options_row.text_content() + '\n'
+						question_options.append({'text': question_options_row.text_content(), 'selected': True})
 					else:
 						attempt_file_contents += 'Option: ' + question_options_row.text_content() + '\n'
+						question_options.append({'text': question_options_row.text_content(), 'selected': False})
 			except Exception:
 				attempt_file_contents += 'Non Multiple Choice question. You can find the entire page in the folder titled "Attempt {}".\n'.format(question_index)
+			exportRecord('test-answer', details_URL + ' ' + str(question_index), institution=institution, attempt=details_URL, student=student_name, attempt_index=attempt_index, question_index=question_index, question=question_title, result=question_result, options=question_options, path=attemptDirectory + '/Question ' + str(question_index) + '.html')
 
 			# Need to download images from hotspot questions
 			content_divs = question_document.find_class('content')
@@ -1213,15 +2583,12 @@ def processOnlineTestAttempt(institution, session, details_URL, dumpDirectory, a
 					if filename is None:
 						filename = '(failed to download image)'
 					attempt_file_contents += 'Attachment image: ' + filename + '\n'
-
-					delay()
 			
 			bytesToTextFile(question_response.text.encode('utf-8'), attemptDirectory + '/Question ' + str(question_index) + '.html')
 
 			attempt_file_contents += '\n'
 
 
-			delay()
 			question_index += 1
 
 		print('\tPage finished, loading next one.')
@@ -1254,16 +2621,16 @@ def processOnlineTestAttempt(institution, session, details_URL, dumpDirectory, a
 		headers = {}
 		headers['Referer'] = form_action_url
 
-		details_page_response = session.post(form_action_url, headers=headers, data=post_data, allow_redirects=True)
-		details_page_document = fromstring(details_page_response.text)
+		details_page_response = Page(session.post(form_action_url, headers=headers, data=post_data, allow_redirects=True))
+		details_page_document = details_page_response.document(postback=True)
 		question_table_body = details_page_document.get_element_by_id('ctl00_ContentPlaceHolder_ResultsGrid_TB')
-		delay()
 	print('\tAll pages have been loaded.')
 	return attempt_file_contents
 
 def dumpOnlineTestAnswerTable(institution, session, dumpDirectory, results_root_element, show_column_class, is_teacher):
 	table_headers = []
 	table_header_classes = []
+	attempts = []
 	for index, table_row in enumerate(results_root_element):
 		# results_root_element[0] is a <caption> element
 		if index == 0:
@@ -1298,24 +2665,52 @@ def dumpOnlineTestAnswerTable(institution, session, dumpDirectory, results_root_
 				if is_teacher and table_cell_class is not None and ('name' in table_cell_class or 'nameH' in table_cell_class):
 					student_name = table_cell_content.strip()
 		
-		# Only dumping the details afterwards so that we get a nice header in the output file containing the attempt details.
-		if details_URL is not None:
-			if not 'attempt_index' in locals():
-				attempt_index = 1
-			attempt_file_contents = processOnlineTestAttempt(institution, session, details_URL, dumpDirectory, attempt_index, student_name, attempt_file_contents)
-		else:
-			print('ERROR: COULD NOT FIND DETAILS PAGE OF ONLINE TEST.')
-			print('NO DETAILS WILL BE SAVED OF THIS TEST.')
+		if details_URL is not None and isCompleted('test-attempt', details_URL):
+			print('\tSkipping attempt to resume from saved state.')
+			continue
+		# The row of an attempt shows its score, so the attempt is downloaded again once it has been graded
+		if details_URL is not None and isItemUnchanged('test-attempt', details_URL, attempt_file_contents):
+			print('\tAttempt has not changed since the previous dump, skipping.')
+			continue
 
+		if details_URL is not None and not 'attempt_index' in locals():
+			attempt_index = 1
+		attempts.append((details_URL, attempt_index, student_name, attempt_file_contents))
 
-		try:
-			bytesToTextFile(attempt_file_contents.encode('utf-8'), dumpDirectory + '/' + sanitiseFilename(student_name) + '/Attempt ' + str(attempt_index) + output_text_extension)
-		except FileNotFoundError:
-			print('\tFailed to save attempt. Usually occurs when an attempt could not be accessed, for instance when you or a student has aborted it prematurely.')
+	# Attempts are dumped in parallel. Their questions are fetched by a pool shared between them.
+	with ThreadPoolExecutor(max_workers=fetch_worker_count) as attempt_pool, ThreadPoolExecutor(max_workers=fetch_worker_count) as question_pool:
+		attempt_dumps = [attempt_pool.submit(withWriteScope(dumpOnlineTestAttempt), institution, session, dumpDirectory, question_pool, *attempt) for attempt in attempts]
+		for attempt_dump in attempt_dumps:
+			attempt_dump.result()
 
-def processOnlineTest(institution, pathThusFar, nttUrl, nttID, session):
-	online_test_response = session.get(nttUrl, allow_redirects=True)
-	online_test_document = fromstring(online_test_response.text)
+def dumpOnlineTestAttempt(institution, session, dumpDirectory, question_pool, details_URL, attempt_index, student_name, attempt_file_contents):
+	session = thread_session(session)
+	attempt_fingerprint = attempt_file_contents
+
+	# Only dumping the details afterwards so that we get a nice header in the output file containing the attempt details.
+	if details_URL is not None:
+		attempt_file_contents = processOnlineTestAttempt(institution, session, details_URL, dumpDirectory, attempt_index, student_name, attempt_file_contents, question_pool)
+	else:
+		print('ERROR: COULD NOT FIND DETAILS PAGE OF ONLINE TEST.')
+		print('NO DETAILS WILL BE SAVED OF THIS TEST.')
+
+
+	# The directory of the student is created while dumping the attempt, and is missing when the attempt could not be accessed.
+	# Files are written in the background, so this is checked up front rather than waiting for the write to fail.
+	# Paths which are too long for Windows are saved to the overflow directory instead, whether their directory exists or not.
+	attempt_file_name = sanitisePath(dumpDirectory + '/' + sanitiseFilename(student_name) + '/Attempt ' + str(attempt_index) + output_text_extension)
+	is_overflowing = len(os.path.abspath(attempt_file_name)) >= 254 and 'Windows' in platform.system()
+	if packed_output is None and not is_overflowing and not os.path.isdir(os.path.dirname(attempt_file_name)):
+		print('\tFailed to save attempt. Usually occurs when an attempt could not be accessed, for instance when you or a student has aborted it prematurely.')
+		return
+	bytesToTextFile(attempt_file_contents.encode('utf-8'), attempt_file_name)
+	if details_URL is not None:
+		recordItem('test-attempt', details_URL, attempt_fingerprint)
+		markCompleted('test-attempt', details_URL)
+
+def processOnlineTest(institution, pathThusFar, nttUrl, nttID, session, is_unchanged=False):
+	online_test_response = fetchPage(session, nttUrl, allow_redirects=True)
+	online_test_document = online_test_response.document(postback=True)
 
 	# Special case for arbitrary It's Learning internal error
 	if online_test_response.status_code // 100 == 5:
@@ -1375,7 +2770,8 @@ def processOnlineTest(institution, pathThusFar, nttUrl, nttID, session):
 			intro_text += etree.tostring(testIntro, encoding='utf-8', pretty_print=True)
 
 
-		bytesToTextFile(info_file_contents.encode('utf-8') + intro_text, dumpDirectory + '/Test Information' + output_text_extension)
+		if not is_unchanged:
+			bytesToTextFile(info_file_contents.encode('utf-8') + intro_text, dumpDirectory + '/Test Information' + output_text_extension)
 
 		# Download test answers
 
@@ -1393,7 +2789,8 @@ def processOnlineTest(institution, pathThusFar, nttUrl, nttID, session):
 
 		info_file_contents = (info_file_contents + '\n\nDescription:\n').encode('utf-8') + etree.tostring(test_description_element[1], encoding='utf-8')
 
-		bytesToTextFile(info_file_contents, dumpDirectory + '/Test Information' + output_text_extension)
+		if not is_unchanged:
+			bytesToTextFile(info_file_contents, dumpDirectory + '/Test Information' + output_text_extension)
 
 		pages_remaining = True
 		page_id = 0
@@ -1406,8 +2803,8 @@ def processOnlineTest(institution, pathThusFar, nttUrl, nttID, session):
 			# Handle table pagination
 			page_id += 1
 			print('\tLoading next page')
-			next_page_response = doPostBack(redirected_page_URL, 'resultsTable', online_test_document, postback_parameter='Paging:{}'.format(page_id))
-			online_test_document = fromstring(next_page_response.text)
+			next_page_response = doPostBack(session, redirected_page_URL, 'resultsTable', online_test_document, postback_parameter='Paging:{}'.format(page_id))
+			online_test_document = next_page_response.document(postback=True)
 			results_table_element = online_test_document.get_element_by_id('resultsTable_table')
 
 			if len(results_table_element) == 3 and len(results_table_element[2]) == 1:
@@ -1417,133 +2814,303 @@ def processOnlineTest(institution, pathThusFar, nttUrl, nttID, session):
 
 
 def processFile(institution, pathThusFar, fileURL, session):
-	file_response = session.get(fileURL, allow_redirects=True)
+	file_response = fetchPage(session, fileURL, allow_redirects=True)
 
 	#writeHTML(file_response, 'output.html')
 	# Find all download links
 	
-	download_link_indices = [m.start() for m in re.finditer('/file/download\.aspx\?FileID=', file_response.text)]
+	download_link_indices = [m.start() for m in re.finditer(r'/file/download\.aspx\?FileID=', file_response.text)]
 
 	if len(download_link_indices) > 1:
 		print('\tMultiple versions of file were found on page.')
 
 	# Download each of them
+	failed_download_count = 0
 	for index, link_start_index in enumerate(download_link_indices):
 		link_end_index = file_response.text.find('"', link_start_index + 1)
 		file_index = None
 		if len(download_link_indices) > 1:
 			file_index = index
 			print('\tDownloading version {} of {}.'.format(index+1, len(download_link_indices)))
-		
-		download_file(institution, itslearning_root_url[institution] + file_response.text[link_start_index:link_end_index], pathThusFar, session, file_index)
 
-def processFolder(institution, pathThusFar, folderURL, session, courseIndex, folder_state = [], level = 0, catch_up_state = None):
-	print("\tDumping folder: ", pathThusFar.encode('ascii', 'ignore'))
-	pathThusFar = sanitisePath(pathThusFar)
-	if not os.path.exists(pathThusFar):
-		pathThusFar = makeDirectories(pathThusFar)
+		# Each version of a file has its own ID, and the contents of a version never change
+		file_link = file_response.text[link_start_index:link_end_index]
+		file_id = file_link.split('FileID=')[1].split('&')[0]
+		if isItemUnchanged('file', file_id) or isCompleted('file', file_id):
+			print('\tFile was downloaded previously, skipping.')
+			continue
+
+		# Failures are reported along with the folder item, so it is tried again as a whole
+		if download_file(institution, itslearning_root_url[institution] + file_link, pathThusFar, session, file_index, report_failure=False) is None:
+			failed_download_count += 1
+			continue
+		recordItem('file', file_id)
+		markCompleted('file', file_id)
 
-	folder_response = session.get(folderURL, allow_redirects=True)
-	#writeHTML(folder_response, 'output.html')
-	folder_response_document = fromstring(folder_response.text)
+	if failed_download_count > 0 and not offline_mode:
+		raise DownloadFailedError('{} of {} versions of the file could not be downloaded: {}'.format(failed_download_count, len(download_link_indices), fileURL))
+	# Nothing is downloaded in offline mode, so the item doesn't count as saved
+	return failed_download_count == 0
 
+def parseFolderListing(folder_response_document):
+	# Returns the name, URL and a fingerprint of every entry in a folder listing.
 	folder_contents_table = folder_response_document.get_element_by_id('ctl00_ContentPlaceHolder_ProcessFolderGrid_T')
 	folder_contents_tbody = folder_contents_table[1]
 
 	if folder_contents_tbody[0][0].get('class') == 'emptytablecell':
-		print('\tFolder is empty.')
-		return
+		return []
 
 	item_title_column = 1
 	if folder_contents_table[0][0][0].get('class') == 'selectcolumn':
 		item_title_column = 2
 
-	for index, folder_contents_entry in enumerate(folder_contents_tbody):
-		
-		if catch_up_state is not None:
-			target_course_id = catch_up_state[0]
-			target_folder_state = catch_up_state[1]
-			# We only want to fast-forward within the course we're catching up to
-			if target_course_id == courseIndex and index < len(target_folder_state) and index < target_folder_state[level]:
-				print('\tSkipping item to resume from saved state.')
-				continue
+	folder_items = []
+	for folder_contents_entry in folder_contents_tbody:
+		item_name = folder_contents_entry[item_title_column][0].text
+		item_url = folder_contents_entry[item_title_column][0].get('href')
+		# Elements are compared by their row in the folder listing, which contains their title and when they were last changed.
+		item_fingerprint = ' '.join(folder_contents_entry.text_content().split())
+		folder_items.append((item_name, item_url, item_fingerprint))
+	return folder_items
+
+def processFolderItem(institution, pathThusFar, item_url, item_name, session, is_unchanged=False):
+	# Dumps anything that can be found in a folder, except other folders.
+	# Returns False if the item was not saved completely, and should not be recorded as done.
+	# Items which contain others are entered even if their entry in the folder is unchanged (`is_unchanged`), to find new submissions,
+	# threads, responses and attempts. Their own description pages are only saved again if the entry changed.
+	if item_url.startswith('/File'):
+		return processFile(institution, pathThusFar, itslearning_file_base_url[institution] + item_url.split('=')[1], session)
+	elif item_url.startswith('/essay'):
+		processAssignment(institution, pathThusFar, itslearning_assignment_base_url[institution] + item_url.split('=')[1], session, is_unchanged)
+	elif item_url.startswith('/Note'):
+		processNote(institution, pathThusFar, itslearning_note_base_url[institution] + item_url.split('=')[1], session)
+	elif item_url.startswith('/discussion'):
+		processDiscussionForum(institution, pathThusFar, itslearning_discussion_base_url[institution] + item_url.split('=')[1], session, is_unchanged)
+	elif item_url.startswith('/weblink'):
+		processWeblink(institution, pathThusFar, itslearning_weblink_base_url[institution] + item_url.split('=')[1], item_name, session)
+	elif item_url.startswith('/LearningToolElement'):
+		processLearningToolElement(institution, pathThusFar, itslearning_learning_tool_base_url[institution] + item_url.split('=')[1], session)
+	elif item_url.startswith('/test'):
+		processTest(institution, pathThusFar, itslearning_test_base_url[institution] + item_url.split('=')[1], session, is_unchanged)
+	elif item_url.startswith('/picture'):
+		processPicture(institution, pathThusFar, itslearning_picture_url[institution].format(item_url.split('=')[1]), session)
+	elif item_url.startswith('/Ntt'):
+		processOnlineTest(institution, pathThusFar, itslearning_online_test_url[institution].format(item_url.split('=')[1]), item_url.split('=')[1], session, is_unchanged)
+	elif item_url.startswith('/CustomActivity'):
+		processCustomActivity(institution, pathThusFar, itslearning_learning_tool_custom_base_url[institution] + item_url.split('=')[1], session)
+	else:
+		print('Warning: Skipping unknown URL:', item_url.encode('ascii', 'ignore'))
+
+def printSkipNotice():
+	print('The item has been skipped, and added to {} in the output directory.'.format(failed_items_file_name))
+	print('Once the script is done, run it again with --retry-failed to try the skipped items once more.')
+
+# The error information can be passed in when the crash happened on another thread
+# Folders that failed to be listed are reported as kind 'folder', with the complete URL of the folder.
+def reportFolderItemCrash(institution, pathThusFar, item_url, item_name, item_fingerprint, error_information=None, kind='element'):
+	if error_information is None:
+		error_information = traceback.format_exc()
+	with console_lock:
+		print('\n\nSTART OF ERROR INFORMATION\n\n\n\n')
+		print(error_information)
+		print('\n\n\n\nEND OF ERROR INFORMATION')
+		print()
+		print('Oh no! The script crashed while trying to download the following address:')
+		print(item_url.encode('ascii', 'ignore'))
+		print('Some information regarding the error is shown above.')
+		print('Please mail a screenshot of this information to bart.van.blokland@ntnu.no, and I can see if I can help you fix it.')
+		printSkipNotice()
+	recordFailure(kind, error_information, institution=institution, path=pathThusFar, url=item_url, name=item_name, fingerprint=item_fingerprint)
+
+def dumpFolderItem(institution, pathThusFar, item_url, item_name, item_fingerprint, session):
+	# A file of the item which could not be written is reported as a failure of the whole item, so it is downloaded again by --retry-failed
+	def reportFailedWrite(error_information):
+		recordFailure('element', error_information, institution=institution, path=pathThusFar, url=item_url, name=item_name, fingerprint=item_fingerprint)
+	try:
+		with WriteScope(reportFailedWrite):
+			if processFolderItem(institution, pathThusFar, item_url, item_name, session, isItemUnchanged('element', item_url, item_fingerprint)) is False:
+				return
+			recordItem('element', item_url, item_fingerprint)
+			markCompleted('element', item_url)
+	except Exception:
+		reportFolderItemCrash(institution, pathThusFar, item_url, item_name, item_fingerprint)
+
+container_element_prefixes = ('/Folder', '/essay', '/discussion', '/test', '/Ntt')
+
+def shouldSkipFolderItem(item_url, item_name, item_fingerprint):
+	if isCompleted('element', item_url):
+		print('\tSkipping item to resume from saved state.')
+		return True
+	# Folders, assignments, forums, surveys and online tests are always entered, since their contents may have changed regardless.
+	# The submissions, threads, responses and attempts inside of them are skipped by themselves instead.
+	if not item_url.startswith(container_element_prefixes) and isItemUnchanged('element', item_url, item_fingerprint):
+		print('\tItem has not changed since the previous dump, skipping:', item_name.encode('ascii', 'ignore'))
+		return True
+	return False
+
+class FolderWalk:
+	# Walks the folders of a course breadth-first. Folders and the items in them are tasks in a queue, which is drained by a number of workers.
+	# Folders are taken from the queue before items, so the whole tree is discovered early on, while the items are downloaded.
+	# A folder is only completed once everything inside of it is.
+	def __init__(self, institution, session, worker_count):
+		self.institution = institution
+		self.session = session
+		self.worker_count = worker_count
+		self.condition = threading.Condition()
+		self.folder_tasks = deque()
+		self.item_tasks = deque()
+		self.active_task_count = 0
+		self.finished_task_count = 0
+		self.discovered_task_count = 0
+		# Folder URL -> number of tasks inside of it which are not yet finished
+		self.remaining_tasks = {}
+		self.parent_folders = {}
+		self.root_exception = None
+		self.abort_exception = None
+
+	def run(self, pathThusFar, folderURL):
+		with self.condition:
+			self.addTask(('folder', pathThusFar, folderURL, None, None, None))
+		workers = [threading.Thread(target=self.work, daemon=True) for i in range(self.worker_count)]
+		for worker in workers:
+			worker.start()
+		for worker in workers:
+			worker.join()
+		if self.abort_exception is not None:
+			raise self.abort_exception
+		if self.root_exception is not None:
+			raise self.root_exception
+
+	# Needs to be called while holding the lock
+	def addTask(self, task):
+		if task[0] == 'folder':
+			self.folder_tasks.append(task)
+		else:
+			self.item_tasks.append(task)
+		self.discovered_task_count += 1
+		self.condition.notify()
+
+	def nextTask(self):
+		with self.condition:
+			while len(self.folder_tasks) == 0 and len(self.item_tasks) == 0 and self.active_task_count > 0:
+				self.condition.wait()
+			if len(self.folder_tasks) > 0:
+				task = self.folder_tasks.popleft()
+			elif len(self.item_tasks) > 0:
+				task = self.item_tasks.popleft()
+			else:
+				return None
+			self.active_task_count += 1
+			return task
+
+	def work(self):
+		while True:
+			task = self.nextTask()
+			if task is None:
+				return
+			kind, pathThusFar, url, item_name, item_fingerprint, parentURL = task
+			try:
+				if kind == 'folder':
+					self.processFolder(pathThusFar, url, parentURL)
+				else:
+					dumpFolderItem(self.institution, pathThusFar, url, item_name, item_fingerprint, thread_session(self.session))
+					self.taskFinished(parentURL)
+			except Exception as e:
+				if parentURL is None:
+					self.root_exception = e
+				else:
+					try:
+						reportFolderItemCrash(self.institution, pathThusFar, url, item_name, item_fingerprint, traceback.format_exc(), 'folder' if kind == 'folder' else 'element')
+					except BaseException as abort:
+						self.abort(abort)
+					# Like before, a folder that crashed counts as done once it was skipped
+					self.taskFinished(parentURL)
+			except BaseException as e:
+				self.abort(e)
+			finally:
+				with self.condition:
+					self.active_task_count -= 1
+					self.finished_task_count += 1
+					self.condition.notify_all()
+
+	def abort(self, exception):
+		with self.condition:
+			self.abort_exception = exception
+			self.folder_tasks.clear()
+			self.item_tasks.clear()
+
+	def taskFinished(self, folderURL):
+		with self.condition:
+			while folderURL is not None:
+				self.remaining_tasks[folderURL] -= 1
+				if self.remaining_tasks[folderURL] > 0:
+					break
+				markCompleted('folder', folderURL)
+				folderURL = self.parent_folders.get(folderURL)
 
-		# Write the current status file (saves progress)
-		if enable_checkpoints:
-			if os.path.exists(progress_file_location):
-				os.remove(progress_file_location)
+	def processFolder(self, pathThusFar, folderURL, parentURL):
+		if isCompleted('folder', folderURL):
+			print('\tSkipping folder to resume from saved state:', pathThusFar.encode('ascii', 'ignore'))
+			self.taskFinished(parentURL)
+			return
 
-			progress_file_contents = (str(courseIndex) + '\n' + ', '.join([str(i) for i in folder_state + [index]])).encode('utf-8')
-			with open(progress_file_location, 'wb') as state_file:
-				state_file.write(progress_file_contents)
+		print("\tDumping folder: ", pathThusFar.encode('ascii', 'ignore'))
+		pathThusFar = sanitisePath(pathThusFar)
+		if not os.path.exists(pathThusFar):
+			pathThusFar = makeDirectories(pathThusFar)
 
-		item_name = folder_contents_entry[item_title_column][0].text
-		item_url = folder_contents_entry[item_title_column][0].get('href')
+		folder_response = fetchPage(thread_session(self.session), folderURL, allow_redirects=True)
+		#writeHTML(folder_response, 'output.html')
+		folder_response_document = folder_response.document()
+
+		folder_items = parseFolderListing(folder_response_document)
+		if len(folder_items) == 0:
+			print('\tFolder is empty.')
+
+		tasks = []
+		for item_name, item_url, item_fingerprint in folder_items:
+			if shouldSkipFolderItem(item_url, item_name, item_fingerprint):
+				continue
 
-		try: 
 			if item_url.startswith('/Folder'):
-				folderURL = itslearning_folder_base_url[institution] + item_url.split('=')[1]
-				processFolder(institution, pathThusFar + "/Folder - " + item_name, folderURL, session, courseIndex, folder_state + [index], level + 1)
-			elif item_url.startswith('/File'):
-				pass
-				processFile(institution, pathThusFar, itslearning_file_base_url[institution] + item_url.split('=')[1], session)
-			elif item_url.startswith('/essay'):
-				pass
-				processAssignment(institution, pathThusFar, itslearning_assignment_base_url[institution] + item_url.split('=')[1], session)
-			elif item_url.startswith('/Note'):
-				pass
-				processNote(institution, pathThusFar, itslearning_note_base_url[institution] + item_url.split('=')[1], session)
-			elif item_url.startswith('/discussion'):
-				pass
-				processDiscussionForum(institution, pathThusFar, itslearning_discussion_base_url[institution] + item_url.split('=')[1], session)
-			elif item_url.startswith('/weblink'):
-				pass
-				processWeblink(institution, pathThusFar, itslearning_weblink_base_url[institution] + item_url.split('=')[1], item_name, session)
-			elif item_url.startswith('/LearningToolElement'):
-				pass
-				processLearningToolElement(institution, pathThusFar, itslearning_learning_tool_base_url[institution] + item_url.split('=')[1], session)
-			elif item_url.startswith('/test'):
-				pass
-				processTest(institution, pathThusFar, itslearning_test_base_url[institution] + item_url.split('=')[1], session)
-			elif item_url.startswith('/picture'):
-				pass
-				processPicture(institution, pathThusFar, itslearning_picture_url[institution].format(item_url.split('=')[1]), session)
-			elif item_url.startswith('/Ntt'):
-				pass
-				processOnlineTest(institution, pathThusFar, itslearning_online_test_url[institution].format(item_url.split('=')[1]), item_url.split('=')[1], session)
-			elif item_url.startswith('/CustomActivity'):
-				pass
-				processCustomActivity(institution, pathThusFar, itslearning_learning_tool_custom_base_url[institution] + item_url.split('=')[1], session)
+				subfolderURL = itslearning_folder_base_url[self.institution] + item_url.split('=')[1]
+				tasks.append(('folder', pathThusFar + "/Folder - " + item_name, subfolderURL, item_name, None, folderURL))
 			else:
-				print('Warning: Skipping unknown URL:', item_url.encode('ascii', 'ignore'))
-		except Exception:
-			print('\n\nSTART OF ERROR INFORMATION\n\n\n\n')
-			traceback.print_exc()
-			print('\n\n\n\nEND OF ERROR INFORMATION')
-			print()
-			print('Oh no! The script crashed while trying to download the following address:')
-			print(item_url.encode('ascii', 'ignore'))
-			print('Some information regarding the error is shown above.')
-			print('Please mail a screenshot of this information to bart.van.blokland@ntnu.no, and I can see if I can help you fix it.')
-			print('Would you like to skip this item and move on?')
-			print('Type \'skip\' if you\'d like to skip this element and continue downloading any remaining elements, or anything else if you\'d like to abort the download.')
-			decision = input('Skip this element? ')
-			if decision != 'skip':
-				print('Download has been aborted.')
-				sys.exit(0)
+				tasks.append(('item', pathThusFar, item_url, item_name, item_fingerprint, folderURL))
 
+		with self.condition:
+			self.parent_folders[folderURL] = parentURL
+			# The folder itself counts as well, so it can't be completed before all of its contents are queued
+			self.remaining_tasks[folderURL] = len(tasks) + 1
+			for task in tasks:
+				self.addTask(task)
+			print('\tProgress: {} of {} tasks done, {} folders and {} items queued.'.format(self.finished_task_count, self.discovered_task_count, len(self.folder_tasks), len(self.item_tasks)))
+		# The folder's own task in its parent is finished once the folder is
+		self.taskFinished(folderURL)
 
-		# Ensure some delay has occurred so that we are not spamming when querying lots of empty folders.
-		delay()
+def processFolder(institution, pathThusFar, folderURL, session):
+	FolderWalk(institution, session, fetch_worker_count).run(pathThusFar, folderURL)
 
 def loadMessagingPage(institution, index, session):
-	url = itslearning_new_messaging_api_url[institution].format(index)
-	return json.loads(session.get(url, allow_redirects=True).text)
+	url = itslearning_new_messaging_api_url[institution].format(index, messaging_page_size)
+	return json.loads(thread_session(session).get(url, allow_redirects=True).text)
+
+def downloadMessageAttachment(institution, url, attachmentsDirectory, session):
+	return download_file(institution, url, attachmentsDirectory, thread_session(session), index=None, filename=None)
 
 def processMessaging(institution, pathThusFar, session):
+	with ThreadPoolExecutor(max_workers=fetch_worker_count) as page_pool, ThreadPoolExecutor(max_workers=fetch_worker_count) as attachment_pool:
+		processNewMessaging(institution, pathThusFar, session, page_pool, attachment_pool)
+	processOldMessaging(institution, pathThusFar, session)
+
+def processNewMessaging(institution, pathThusFar, session, page_pool, attachment_pool):
 	batchIndex = 0
 	threadIndex = 0
-	messageBatch = loadMessagingPage(institution, batchIndex, session)
+
+	# Pages are parsed on the threads that fetch them. They are processed in order, since the threads are numbered by their position in the inbox.
+	upcoming_batches = [page_pool.submit(loadMessagingPage, institution, index, session) for index in range(fetch_worker_count)]
+	next_batch_index = fetch_worker_count
+	messageBatch = upcoming_batches.pop(0).result()
 
 	dumpDirectory = os.path.join(os.path.join(pathThusFar, os.path.join('Messaging', institution.upper())), 'New API')
 	dumpDirectory = makeDirectories(dumpDirectory)
@@ -1553,30 +3120,66 @@ def processMessaging(institution, pathThusFar, session):
 	print('Downloading messages (sent through the new API)')
 
 	while len(messageBatch['EntityArray']) > 0:
+		upcoming_batches.append(page_pool.submit(loadMessagingPage, institution, next_batch_index, session))
+		next_batch_index += 1
+
 		print('\tDownloading message batch {}'.format(batchIndex))
+		saved_threads = []
 		for messageThread in messageBatch['EntityArray']:
-			threadFileContents = ''
-			for message in messageThread['Messages']['EntityArray']:
-				threadFileContents += 'From: ' + html.unescape(message['CreatedByName']) + '\n'
-				threadFileContents += 'Sent on: ' + html.unescape(message['CreatedFormatted']) + '\n'
+			thread_messages = messageThread['Messages']['EntityArray']
+			thread_id = messageThread.get('InstantMessageThreadId')
+			if thread_id is None and len(thread_messages) > 0:
+				thread_id = thread_messages[0]['InstantMessageThreadId']
+			# A thread only changes when messages are added to it
+			thread_fingerprint = '{} {}'.format(len(thread_messages), thread_messages[-1]['CreatedFormatted'] if len(thread_messages) > 0 else '')
+			if isItemUnchanged('message-thread', thread_id, thread_fingerprint) or isCompleted('message-thread', thread_id):
+				threadIndex += 1
+				continue
+
+			threadFileContents = []
+			attachment_downloads = []
+			for message_index, message in enumerate(messageThread['Messages']['EntityArray']):
+				threadFileContents.append('From: ' + html.unescape(message['CreatedByName']) + '\n')
+				threadFileContents.append('Sent on: ' + html.unescape(message['CreatedFormatted']) + '\n')
 				if message['AttachmentName'] is not None:
-					threadFileContents += 'Attachment: ' + html.unescape(message['AttachmentName']) + '\n'
-				threadFileContents += '\n'
-				threadFileContents += html.unescape(message['Text']) + '\n'
-				threadFileContents += '\n'
-				threadFileContents += '-------------------------------------------------------------------------\n'
+					threadFileContents.append('Attachment: ' + html.unescape(message['AttachmentName']) + '\n')
+				threadFileContents.append('\n')
+				threadFileContents.append(html.unescape(message['Text']) + '\n')
+				threadFileContents.append('\n')
+				threadFileContents.append('-------------------------------------------------------------------------\n')
+				exportRecord('message', '{} {}'.format(thread_id, message_index), institution=institution, api='new', thread_id=thread_id, author=html.unescape(message['CreatedByName']), sent=html.unescape(message['CreatedFormatted']), attachment=html.unescape(message['AttachmentName']) if message['AttachmentName'] is not None else None, text=html.unescape(message['Text']))
 				
 				if message['AttachmentName'] is not None:
-					download_file(institution, message['AttachmentUrl'], attachmentsDirectory, session, index=None, filename=None)#str(message['InstantMessageThreadId']) + '_' + message['AttachmentName'])
-			thread_title = 'Message thread ' + str(threadIndex) + ' - ' + sanitiseFilename(messageThread['Created']) + '.txt'
-			threadFileContents = threadFileContents.encode('utf-8')
-			bytesToTextFile(threadFileContents, os.path.join(dumpDirectory, thread_title))
+					attachment_downloads.append(attachment_pool.submit(downloadMessageAttachment, institution, message['AttachmentUrl'], attachmentsDirectory, session))
+			thread_title = 'Message thread ' + itemFileNumber(threadIndex, thread_id) + ' - ' + sanitiseFilename(messageThread['Created']) + '.txt'
+			threadFileContents = ''.join(threadFileContents).encode('utf-8')
+			# The thread is marked in the same scope once its attachments are done, so it isn't marked if its file could not be written
+			thread_scope = WriteScope()
+			with thread_scope:
+				bytesToTextFile(threadFileContents, os.path.join(dumpDirectory, thread_title))
+			saved_threads.append((thread_id, thread_fingerprint, attachment_downloads, thread_scope))
 			threadIndex += 1
 
-		delay()
+		# A thread is only done once its attachments are
+		for thread_id, thread_fingerprint, attachment_downloads, thread_scope in saved_threads:
+			for attachment_download in attachment_downloads:
+				attachment_download.result()
+			with thread_scope:
+				recordItem('message-thread', thread_id, thread_fingerprint)
+				markCompleted('message-thread', thread_id)
+
 		batchIndex += 1
-		messageBatch = loadMessagingPage(institution, batchIndex, session)
+		messageBatch = upcoming_batches.pop(0).result()
 
+	for upcoming_batch in upcoming_batches:
+		upcoming_batch.cancel()
+
+# The ID is the only number in the query of the message's address
+def oldMessageID(message_url):
+	message_ids = [value for values in parse_qs(urlparse(message_url).query).values() for value in values if value.isdigit()]
+	return message_ids[0] if len(message_ids) == 1 else None
+
+def processOldMessaging(institution, pathThusFar, session):
 	print('Downloading messages (send through the old API)')
 
 	dumpDirectory = pathThusFar + '/Messaging/' + institution.upper() + '/Old API'
@@ -1584,10 +3187,10 @@ def processMessaging(institution, pathThusFar, session):
 	
 	
 	folderID = 1
-	messaging_response = session.get(old_messaging_api_url[institution].format(folderID), allow_redirects=True)
+	messaging_response = fetchPage(session, old_messaging_api_url[institution].format(folderID), allow_redirects=True)
 
 	while messaging_response.url != itslearning_not_found[institution]:
-		inbox_document = fromstring(messaging_response.text)
+		inbox_document = messaging_response.document(postback=True)
 		inbox_title = inbox_document.get_element_by_id('ctl05_TT').text_content()
 		print('\tAccessing folder {}'.format(inbox_title).encode('ascii', 'ignore'))
 		
@@ -1628,8 +3231,14 @@ def processMessaging(institution, pathThusFar, session):
 					else:
 						# Bug caused by having a < character in the recipients name
 						message_url = itslearning_root_url[institution] + message_element[2][0][0][0].get('href')
-					message_response = session.get(message_url, allow_redirects = True)
-					message_document = fromstring(message_response.text)
+					# Messages in the old system can no longer be changed once they have been sent
+					if isItemUnchanged('old-message', message_url) or isCompleted('old-message', message_url):
+						print('\tMessage was downloaded previously, skipping.')
+						message_index_on_page += 1
+						message_index += 1
+						continue
+					message_response = fetchPage(session, message_url, allow_redirects = True)
+					message_document = message_response.document()
 
 					# In rare cases a message links to an unauthorized page. I have no idea why.
 					if not message_response.url == itslearning_unauthorized_url[institution]:
@@ -1690,19 +3299,23 @@ def processMessaging(institution, pathThusFar, session):
 									message_attachment_url = message_header_element[attachment_index][1][0].get('href')
 									download_file(institution, itslearning_root_url[institution] + message_attachment_url, attachmentsDirectory, session, index=None, filename=attachment_filename, disableFilenameReencode=True)
 
-						message_file_contents = 'From: ' + message_sender + '\n'
-						message_file_contents = 'To: ' + message_recipient + '\n'
-						message_file_contents += 'Subject: ' + message_title + '\n'
-						message_file_contents += 'Sent on: ' + message_send_date + '\n'
+						message_file_contents = ['To: ' + message_recipient + '\n']
+						message_file_contents.append('Subject: ' + message_title + '\n')
+						message_file_contents.append('Sent on: ' + message_send_date + '\n')
 						if message_blind_recipient is not None:
-							message_file_contents += 'Blind copy: ' + message_blind_recipient + '\n'
+							message_file_contents.append('Blind copy: ' + message_blind_recipient + '\n')
 						if has_attachment:
-							message_file_contents += 'Attachment: ' + attachment_filename
-						message_file_contents += 'Message contents: \n\n' + html.unescape(message_body)
+							message_file_contents.append('Attachment: ' + attachment_filename)
+						message_file_contents.append('Message contents: \n\n' + html.unescape(message_body))
 
-						bytesToTextFile(message_file_contents.encode('utf-8'), boxDirectory + '/Message ' + str(message_index) + ' - ' + sanitiseFilename(message_send_date) + output_text_extension)
+						with WriteScope():
+							bytesToTextFile(''.join(message_file_contents).encode('utf-8'), boxDirectory + '/Message ' + itemFileNumber(message_index, oldMessageID(message_url)) + ' - ' + sanitiseFilename(message_send_date) + output_text_extension)
+							exportRecord('message', message_url, institution=institution, api='old', url=message_url, folder=inbox_title, author=message_sender, recipient=message_recipient, blind_copy=message_blind_recipient, subject=message_title, sent=message_send_date, attachment=attachment_filename if has_attachment else None, text=html.unescape(message_body))
+							# Unsent messages can still change, so those are downloaded every time
+							if 'sendmessage.aspx' not in message_response.url:
+								recordItem('old-message', message_url)
+							markCompleted('old-message', message_url)
 
-						delay()
 						# Index 4: Has asttachments
 						# Index 5: Received on
 					else:
@@ -1734,42 +3347,53 @@ def processMessaging(institution, pathThusFar, session):
 					print('This unfortunately means the contents of this message have probably not have been saved.')
 					print('If you\'d like to help resolve this error, please send the marked debug information above to me.')
 					print('You can reach me at bart.van.blokland@ntnu.no.')
-					print('Press enter to skip this error, and continue to dump any remaining messages.')
-					input()
+					print('The message has been added to {} in the output directory, and the script continues with any remaining messages.'.format(failed_items_file_name))
+					recordFailure('message', traceback.format_exc(), institution=institution, url=message_url if 'message_url' in locals() else None, title=message_title if 'message_title' in locals() else None)
 				
 				message_index_on_page += 1
 				message_index += 1
 
 			# Move on to the next page
-			found_next_page, messaging_response = loadPaginationPage(old_messaging_api_url[institution].format(folderID), inbox_document)
+			found_next_page, messaging_response = loadPaginationPage(session, old_messaging_api_url[institution].format(folderID), inbox_document)
 
 			if found_next_page:
-				inbox_document = fromstring(messaging_response.text)
+				inbox_document = messaging_response.document(postback=True)
 				message_index_on_page = 1
 			else:
 				pagesRemain = False
 
 		folderID += 1
-		messaging_response = session.get(old_messaging_api_url[institution].format(folderID), allow_redirects=True)
+		messaging_response = fetchPage(session, old_messaging_api_url[institution].format(folderID), allow_redirects=True)
 
-def dumpSingleBulletin(institution, raw_page_text, bulletin_element, dumpDirectory, bulletin_index):
+def appendComment(file_content, comment):
+	file_content.append('Comment by: ' + comment['UserName'] + '\n')
+	file_content.append('Posted: ' + comment['DateTimeTooltip'] + '\n\n')
+	file_content.append(comment['CommentText'] + '\n\n')
+	file_content.append(' -----\n\n')
+
+# The comments on bulletins are stored in a line of javascript below a line announcing its comment module.
+# All of them are looked up in a single pass over the page, rather than searching the page for every bulletin.
+comment_module_pattern = re.compile(r"CCL\.CommentModule\['CommentModule_LightBulletin_([^']*)_CommentModule'\] = true;[^\n]*\n([^\n]*)")
+
+def commentModules(bulletin_page):
+	if bulletin_page.comment_modules is None:
+		bulletin_page.comment_modules = {match.group(1): match.group(2).strip() for match in comment_module_pattern.finditer(bulletin_page.text)}
+	return bulletin_page.comment_modules
+
+def fetchAdditionalComments(complete_comment_url, session):
+	return json.loads(fetchPage(thread_session(session), complete_comment_url, allow_redirects=True).text)
+
+def readBulletin(institution, bulletin_page, bulletin_element, session, comment_pool):
 	# Post data
 	author = bulletin_element.find_class('itsl-light-bulletins-person-name')[0][0][0].text_content()
 	print('\tBulletin by', author.encode('ascii', 'ignore'))
 	post_content = convert_html_content(bulletin_element.find_class('h-userinput itsl-light-bulletins-list-item-text')[0].get('data-text'))
 
-	bulletin_file_content = 'Author: ' + author + '\n\n' + post_content
-
 	# Comments
 	# This is so hacky, you better not look for a moment
 	# Here we get a specific line of javascript code containing a JSON object with all information we need
 	bulletin_id = bulletin_element[0].get('data-bulletin-id')
-	search_string = 'CCL.CommentModule[\'CommentModule_LightBulletin_' + str(bulletin_id) + '_CommentModule\'] = true;'
-
-	code_start_index = raw_page_text.index(search_string)
-	json_line_start_index = raw_page_text.index('\n', code_start_index)
-	json_line_end_index = raw_page_text.index('\n', json_line_start_index + 1)
-	json_line = raw_page_text[json_line_start_index:json_line_end_index].strip()
+	json_line = commentModules(bulletin_page)[str(bulletin_id)]
 	
 	# Cut the JSON object out of the line
 	json_object_start_index = json_line.index('{')
@@ -1778,43 +3402,71 @@ def dumpSingleBulletin(institution, raw_page_text, bulletin_element, dumpDirecto
 	# Parse the json object string
 	comment_info = json.loads(json_object_string)
 
-	# Only dump comments if there are any
-	if comment_info['DataSource']['VirtualCount'] > 0:
-		bulletin_file_content += '\n\n\n ---------- Comments ----------\n\n'
-		for comment in comment_info['DataSource']['Items']:
-			bulletin_file_content += 'Comment by: ' + comment['UserName'] + '\n'
-			bulletin_file_content += 'Posted: ' + comment['DateTimeTooltip'] + '\n\n'
-			bulletin_file_content += comment['CommentText'] + '\n\n'
-			bulletin_file_content += ' -----\n\n'
+	bulletin_fingerprint = '{} {}'.format(hashlib.sha1(post_content.encode('utf-8')).hexdigest(), comment_info['DataSource']['VirtualCount'])
+	if isItemUnchanged('bulletin', bulletin_id, bulletin_fingerprint) or isCompleted('bulletin', bulletin_id):
+		print('\tBulletin was dumped previously, skipping.')
+		return None
 
+	# If we didn't get all comments, start loading the rest
+	additional_comments = None
+	if comment_info['DataSource']['VirtualCount'] > 0 and len(comment_info['DataSource']['Items']) < comment_info['DataSource']['VirtualCount']:
+		sourceID = comment_info['UserData']['sourceId']
+		sourceType = comment_info['UserData']['sourceType']
+		# The comment ID seems to be the first in the list of comments
+		commentId = comment_info['DataSource']['Items'][0]['Id']
+		# Try to get all at once
+		count = comment_info['DataSource']['VirtualCount']
+		readItemsCount = comment_info['NumberOfPreviouslyReadItemsToDisplay']
+		useLastName = comment_info['UsePersonNameFormatLastFirst']
 
-		# If we didn't get all comments, load the rest
-		if len(comment_info['DataSource']['Items']) < comment_info['DataSource']['VirtualCount']:
-			sourceID = comment_info['UserData']['sourceId']
-			sourceType = comment_info['UserData']['sourceType']
-			# The comment ID seems to be the first in the list of comments
-			commentId = comment_info['DataSource']['Items'][0]['Id']
-			# Try to get all at once
-			count = comment_info['DataSource']['VirtualCount']
-			readItemsCount = comment_info['NumberOfPreviouslyReadItemsToDisplay']
-			useLastName = comment_info['UsePersonNameFormatLastFirst']
+		complete_comment_url = itslearning_comment_service[institution].format(sourceID, sourceType, commentId, count, readItemsCount, useLastName)
+		additional_comments = comment_pool.submit(fetchAdditionalComments, complete_comment_url, session)
 
-			complete_comment_url = itslearning_comment_service[institution].format(sourceID, sourceType, commentId, count, readItemsCount, useLastName)
-			additional_comments = json.loads(session.get(complete_comment_url, allow_redirects=True).text)
+	return bulletin_id, author, post_content, comment_info, bulletin_fingerprint, additional_comments
 
-			delay()
+def writeBulletin(institution, bulletin, dumpDirectory, bulletin_index):
+	bulletin_id, author, post_content, comment_info, bulletin_fingerprint, additional_comments = bulletin
+
+	bulletin_file_content = ['Author: ' + author + '\n\n' + post_content]
+	comments = []
+
+	# Only dump comments if there are any
+	if comment_info['DataSource']['VirtualCount'] > 0:
+		bulletin_file_content.append('\n\n\n ---------- Comments ----------\n\n')
+		comments.extend(comment_info['DataSource']['Items'])
+		for comment in comment_info['DataSource']['Items']:
+			appendComment(bulletin_file_content, comment)
 
+		if additional_comments is not None:
+			additional_comments = additional_comments.result()
+			comments.extend(additional_comments['Items'])
 			for additional_comment in additional_comments['Items']:
-				bulletin_file_content += 'Comment by: ' + additional_comment['UserName'] + '\n'
-				bulletin_file_content += 'Posted: ' + additional_comment['DateTimeTooltip'] + '\n\n'
-				bulletin_file_content += additional_comment['CommentText'] + '\n\n'
-				bulletin_file_content += ' -----\n\n'
+				appendComment(bulletin_file_content, additional_comment)
+
+	with WriteScope():
+		bytesToTextFile(''.join(bulletin_file_content).encode('utf-8'), dumpDirectory + '/Bulletin ' + itemFileNumber(bulletin_index, bulletin_id) + output_text_extension)
+		exportRecord('bulletin', bulletin_id, institution=institution, id=bulletin_id, path=dumpDirectory, author=author, text=post_content)
+		for comment in comments:
+			exportRecord('comment', comment.get('Id'), institution=institution, id=comment.get('Id'), bulletin_id=bulletin_id, author=comment['UserName'], posted=comment['DateTimeTooltip'], text=comment['CommentText'])
+		recordItem('bulletin', bulletin_id, bulletin_fingerprint)
+		markCompleted('bulletin', bulletin_id)
+
+def dumpBulletins(institution, bulletins, dumpDirectory):
+	# Writes bulletins read by readBulletin() in order, as their comments come in
+	for bulletin_index, bulletin in bulletins:
+		if bulletin is not None:
+			writeBulletin(institution, bulletin, dumpDirectory, bulletin_index)
 
-	bytesToTextFile(bulletin_file_content.encode('utf-8'), dumpDirectory + '/Bulletin ' + str(bulletin_index) + output_text_extension)
+def fetchBulletinPage(institution, courseID, next_bulletin_batch, session):
+	return fetchPage(thread_session(session), itslearning_bulletin_next_url[institution].format(courseID, next_bulletin_batch['BoundaryLightBulletinId'], next_bulletin_batch['BoundaryLightBulletinCreatedTicks']))
 
 def processBulletins(institution, pathThusFar, courseURL, session, courseID):
-	bulletin_response = session.get(courseURL, allow_redirects=True)
-	bulletin_document = fromstring(bulletin_response.text)
+	with ThreadPoolExecutor(max_workers=1) as page_pool, ThreadPoolExecutor(max_workers=fetch_worker_count) as comment_pool:
+		processBulletinPages(institution, pathThusFar, courseURL, session, courseID, page_pool, comment_pool)
+
+def processBulletinPages(institution, pathThusFar, courseURL, session, courseID, page_pool, comment_pool):
+	bulletin_response = fetchPage(session, courseURL, allow_redirects=True)
+	bulletin_document = bulletin_response.document()
 
 	is_new_style_bulletins = True
 
@@ -1836,16 +3488,12 @@ def processBulletins(institution, pathThusFar, courseURL, session, courseID):
 		dumpDirectory = pathThusFar + '/Bulletins'
 		dumpDirectory = makeDirectories(dumpDirectory)
 
-		bulletin_id = 0
-
+		bulletin_elements = []
 		for index, bulletin_element in enumerate(bulletin_list_element):
 			# Skip the box for writing a new bulletin
 			if index == 0 and 'itsl-light-bulletins-new-item-listitem' in bulletin_element.get('class'):
 				continue
-
-			bulletin_id += 1
-
-			dumpSingleBulletin(institution, bulletin_response.text, bulletin_element, dumpDirectory, bulletin_id)
+			bulletin_elements.append(bulletin_element)
 
 		# Get initial next page settings
 		field_name = '"InitialPageData"'
@@ -1854,22 +3502,35 @@ def processBulletins(institution, pathThusFar, courseURL, session, courseID):
 		next_bulletin_batch_string = '{' + bulletin_response.text[json_field_start_index:json_field_end_index] + '} }'
 		next_bulletin_batch = json.loads(next_bulletin_batch_string)['InitialPageData']
 
-		# Now we keep going until all bulletins have been downloaded
-		while next_bulletin_batch['NeedToShowMore']:
-			print('\tLoading more bulletins')
-			additional_bulletins_response = session.get(itslearning_bulletin_next_url[institution].format(courseID, next_bulletin_batch['BoundaryLightBulletinId'], next_bulletin_batch['BoundaryLightBulletinCreatedTicks']))
-			additional_bulletins_document = fromstring(additional_bulletins_response.text)
+		# Now we keep going until all bulletins have been downloaded.
+		# The next page is requested as soon as we know where it starts, so it loads while the comments on the current page are being fetched.
+		bulletin_id = 0
+		while True:
+			next_bulletins = None
+			if next_bulletin_batch['NeedToShowMore']:
+				next_bulletins = page_pool.submit(fetchBulletinPage, institution, courseID, next_bulletin_batch, session)
+
+			bulletins = []
+			for bulletin_element in bulletin_elements:
+				bulletin_id += 1
+				bulletins.append((bulletin_id, readBulletin(institution, bulletin_response, bulletin_element, session, comment_pool)))
+			dumpBulletins(institution, bulletins, dumpDirectory)
 
-			for bulletin_element in additional_bulletins_document:
+			if next_bulletins is None:
+				break
+
+			print('\tLoading more bulletins')
+			bulletin_response = next_bulletins.result()
+			bulletin_elements = []
+			# A page without the metadata for the next one is the last one
+			next_bulletin_batch = {'NeedToShowMore': False}
+			for bulletin_element in bulletin_response.document():
 				# Final element means we need to extract the metadata to request the next page
 				if bulletin_element.get('data-pagedata') is not None and 'NeedToShowMore' in bulletin_element.get('data-pagedata'):
 					next_bulletin_batch = json.loads(html.unescape(bulletin_element.get('data-pagedata')))
 					break
+				bulletin_elements.append(bulletin_element)
 
-				bulletin_id += 1
-				dumpSingleBulletin(institution, additional_bulletins_response.text, bulletin_element, dumpDirectory, bulletin_id)
-
-			delay()
 	bulletin_list_elements1 = bulletin_document.xpath('//div[@id = $elementid]', elementid = 'ctl00_ContentPlaceHolder_DashboardLayout_ctl04_ctl04_CT')
 	bulletin_list_elements2 = bulletin_document.xpath('//div[@id = $elementid]', elementid = 'ctl00_ContentPlaceHolder_DashboardLayout_ctl04_ctl03_CT')
 	bulletin_list_elements = [i.find_class('itsl-cb-news-old-bulletin-list') for i in (bulletin_list_elements1 + bulletin_list_elements2)]
@@ -1938,12 +3599,13 @@ def processBulletins(institution, pathThusFar, courseURL, session, courseID):
 					file_path = dumpDirectory + '/Bulletin ' + str(bulletin_id) + output_text_extension
 
 					bytesToTextFile(bulletin_file_content.encode('utf-8'), file_path)
+					exportRecord('bulletin', ' '.join([courseID, bulletin_post_date, bulletin_author, bulletin_subject]), institution=institution, path=dumpDirectory, author=bulletin_author, posted=bulletin_post_date, subject=bulletin_subject, text=bulletin_message)
 
 					# No support for comments here. I couldn't find any course that had them.
 
 def processProjectBulletins(institution, pathThusFar, pageURL, session):
-	bulletin_response = session.get(pageURL, allow_redirects=True)
-	bulletin_document = fromstring(bulletin_response.text)
+	bulletin_response = fetchPage(session, pageURL, allow_redirects=True)
+	bulletin_document = bulletin_response.document()
 
 	dumpDirectory = pathThusFar + '/Bulletins'
 	dumpDirectory = makeDirectories(dumpDirectory)
@@ -1967,10 +3629,11 @@ def processProjectBulletins(institution, pathThusFar, pageURL, session):
 		file_path = dumpDirectory + '/Bulletin ' + str(index + 1) + output_text_extension
 
 		bytesToTextFile(bulletin_file_content.encode('utf-8'), file_path)
+		exportRecord('bulletin', ' '.join([pageURL, bulletin_post_date, bulletin_author, bulletin_subject]), institution=institution, path=dumpDirectory, author=bulletin_author, posted=bulletin_post_date, subject=bulletin_subject, text=bulletin_message)
 
 def list_courses_or_projects(institution, session, list_page_url, form_string, url_column_index, item_name):
-	course_list_response = session.get(list_page_url[institution], allow_redirects = True)
-	course_list_page = fromstring(course_list_response.text)
+	course_list_response = fetchPage(session, list_page_url[institution], allow_redirects = True)
+	course_list_page = course_list_response.document(postback=True)
 	course_list_form = course_list_page.forms[0]
 	
 	found_field = False
@@ -1992,8 +3655,8 @@ def list_courses_or_projects(institution, session, list_page_url, form_string, u
 
 	# Part 2: Show all courses
 
-		all_courses_response = session.post(list_page_url[institution], data=course_list_dict, allow_redirects = True)
-		all_courses_page = fromstring(all_courses_response.text)
+		all_courses_response = Page(session.post(list_page_url[institution], data=course_list_dict, allow_redirects = True))
+		all_courses_page = all_courses_response.document(postback=True)
 
 	else:
 		# Just use the page we received instead
@@ -2031,42 +3694,50 @@ def list_courses_or_projects(institution, session, list_page_url, form_string, u
 			courseURL = courseTableRowElement[url_column_index][0].get('href').split("=")[1]
 			courseList.append(courseURL)
 			courseNameDict[courseURL] = courseTableRowElement[url_column_index][0][0].text
-		pages_remaining, course_page_response = loadPaginationPage(list_page_url[institution], all_courses_page, 5)
+		pages_remaining, course_page_response = loadPaginationPage(session, list_page_url[institution], all_courses_page, 5)
 		if pages_remaining:
-			all_courses_page = fromstring(course_page_response.text)
+			all_courses_page = course_page_response.document(postback=True)
 
 	return courseList, courseNameDict
 
-def dump_courses_or_projects(institution, session, pathThusFar, itemList, itemNameDict, item_type):
-	for courseIndex, courseURL in enumerate(itemList):
-		try:
-			print('Dumping {} with ID {} ({} of {}): {}'.format(item_type, courseURL, (courseIndex + 1), len(itemList), itemNameDict[courseURL].encode('ascii', 'ignore')))
-			if courseIndex + 1 < skip_to_course_with_index:
-				continue
-			if catch_up_directions is not None and courseIndex + 1 < catch_up_directions[0]:
-				continue
+def dump_course_or_project(institution, session, pathThusFar, itemList, itemNameDict, item_type, courseIndex, folder_processor=None):
+	courseURL = itemList[courseIndex]
+	session = thread_session(session)
+	try:
+		print('Dumping {} with ID {} ({} of {}): {}'.format(item_type, courseURL, (courseIndex + 1), len(itemList), itemNameDict[courseURL].encode('ascii', 'ignore')))
+		if courseIndex + 1 < skip_to_course_with_index:
+			return
+		if isCompleted(item_type, courseURL):
+			print('\tSkipping {} to resume from saved state.'.format(item_type))
+			return
 
-			locationType = {'course': 1, 'project': 2}[item_type]
+		exportRecord(item_type, courseURL, institution=institution, id=courseURL, name=itemNameDict[courseURL])
 
-			course_response = session.get(itslearning_course_base_url[institution].format(courseURL, locationType), allow_redirects=True)
+		locationType = {'course': 1, 'project': 2}[item_type]
 
-			root_folder_url_index = course_response.text.find(itslearning_folder_base_url[institution])
-			root_folder_end_index = course_response.text.find("'", root_folder_url_index + 1)
-			root_folder_url = course_response.text[root_folder_url_index:root_folder_end_index]
+		course_response = fetchPage(session, itslearning_course_base_url[institution].format(courseURL, locationType), allow_redirects=True)
 
-			if item_type == 'course':
-				course_folder = pathThusFar + '/' + sanitiseFilename(itemNameDict[courseURL])
-				bulletin_url = itslearning_course_bulletin_base_url[institution]
-			elif item_type == 'project':
-				course_folder = pathThusFar + '/Projects/' + sanitiseFilename(itemNameDict[courseURL])
-				bulletin_url = itslearning_project_bulletin_base_url[institution]
+		root_folder_url_index = course_response.text.find(itslearning_folder_base_url[institution])
+		root_folder_end_index = course_response.text.find("'", root_folder_url_index + 1)
+		root_folder_url = course_response.text[root_folder_url_index:root_folder_end_index]
 
-			try:
+		if item_type == 'course':
+			course_folder = pathThusFar + '/' + sanitiseFilename(itemNameDict[courseURL])
+			bulletin_url = itslearning_course_bulletin_base_url[institution]
+		elif item_type == 'project':
+			course_folder = pathThusFar + '/Projects/' + sanitiseFilename(itemNameDict[courseURL])
+			bulletin_url = itslearning_project_bulletin_base_url[institution]
+
+		def reportFailedBulletinWrite(error_information):
+			recordFailure('bulletins', error_information, institution=institution, path=course_folder, url=courseURL, item_type=item_type)
+		try:
+			with WriteScope(reportFailedBulletinWrite):
 				if item_type == 'course':
 					processBulletins(institution, course_folder, bulletin_url + courseURL, session, courseURL)
 				elif item_type == 'project':
 					processProjectBulletins(institution, course_folder, bulletin_url.format(courseURL), session)
-			except Exception:
+		except Exception:
+			with console_lock:
 				print('\n\nSTART OF ERROR INFORMATION\n\n\n\n')
 				traceback.print_exc()
 				print('\n\n\n\nEND OF ERROR INFORMATION')
@@ -2075,16 +3746,17 @@ def dump_courses_or_projects(institution, session, pathThusFar, itemList, itemNa
 				print('{}, ID {}, item {} of {}'.format(itemNameDict[courseURL].encode('ascii', 'ignore'), courseURL, (courseIndex + 1), len(itemList)))
 				print('Some information regarding the error is shown above (see the lines marked with (..) ERROR INFORMATION (..) ).')
 				print('Please mail a screenshot of this information to bart.van.blokland@ntnu.no, and I can see if I can help you fix it.')
-				print('Would you like to skip the bulletin messages of this {} and move on to the {} contents?'.format(item_type, item_type))
-				print('Type \'skip\' if you\'d like to skip the bulletin messages and continue downloading any remaining ones, or anything else if you\'d like to abort the download.'.format(item_type))
-				decision = input('Skip this {}? '.format(item_type))
-				if decision != 'skip':
-					print('Download has been aborted.')
-					sys.exit(0)
+				print('The script continues with the contents of the {}.'.format(item_type))
+				printSkipNotice()
+			recordFailure('bulletins', traceback.format_exc(), institution=institution, path=course_folder, url=courseURL, item_type=item_type)
 
 
-			processFolder(institution, course_folder, root_folder_url, session, courseIndex, catch_up_state=catch_up_directions)
-		except Exception as e:
+		if folder_processor is None:
+			folder_processor = processFolder
+		folder_processor(institution, course_folder, root_folder_url, session)
+		markCompleted(item_type, courseURL)
+	except Exception as e:
+		with console_lock:
 			print('\n\nSTART OF ERROR INFORMATION\n\n\n\n')
 			traceback.print_exc()
 			print('\n\n\n\nEND OF ERROR INFORMATION')
@@ -2093,12 +3765,215 @@ def dump_courses_or_projects(institution, session, pathThusFar, itemList, itemNa
 			print('{}, ID {}, item {} of {}'.format(itemNameDict[courseURL].encode('ascii', 'ignore'), courseURL, (courseIndex + 1), len(itemList)))
 			print('Some information regarding the error is shown above (see the lines marked with (..) ERROR INFORMATION (..) ).')
 			print('Please mail a screenshot of this information to bart.van.blokland@ntnu.no, and I can see if I can help you fix it.')
-			print('Would you like to skip this {} and move on to the next one?'.format(item_type))
-			print('Type \'skip\' if you\'d like to skip this {} and continue downloading any remaining ones, or anything else if you\'d like to abort the download.'.format(item_type))
-			decision = input('Skip this {}? '.format(item_type))
-			if decision != 'skip':
-				print('Download has been aborted.')
-				sys.exit(0)
+			printSkipNotice()
+		recordFailure(item_type, traceback.format_exc(), institution=institution, path=pathThusFar, url=courseURL, name=itemNameDict[courseURL])
+
+def retryFailedItem(institution, entry, session):
+	kind = entry['kind']
+	if kind == 'element' and entry['url'].startswith('/Folder'):
+		processFolder(institution, entry['path'] + "/Folder - " + entry['name'], itslearning_folder_base_url[institution] + entry['url'].split('=')[1], session)
+	elif kind == 'element':
+		dumpFolderItem(institution, entry['path'], entry['url'], entry['name'], entry['fingerprint'], session)
+	elif kind == 'folder':
+		processFolder(institution, entry['path'], entry['url'], session)
+	elif kind == 'file':
+		download_file(institution, entry['url'], entry['path'], session, entry['index'], entry['filename'], entry['disable_filename_reencode'])
+	elif kind == 'discussion post':
+		dumpDiscussionPost(institution, entry['path'], entry['url'], entry['title'], session, entry.get('fingerprint'))
+	elif kind == 'bulletins' and entry['item_type'] == 'course':
+		processBulletins(institution, entry['path'], itslearning_course_bulletin_base_url[institution] + entry['url'], session, entry['url'])
+	elif kind == 'bulletins':
+		processProjectBulletins(institution, entry['path'], itslearning_project_bulletin_base_url[institution].format(entry['url']), session)
+	elif kind == 'course' or kind == 'project':
+		dump_course_or_project(institution, session, entry['path'], [entry['url']], {entry['url']: entry['name']}, kind, 0)
+	else:
+		return False
+	return True
+
+def retryFailedItems(institution, session, entries):
+	# Items which fail again are added to the new list of failed items, by the same code that reported them the first time.
+	for entry in entries:
+		if entry.get('institution') != institution:
+			continue
+		print('Retrying {}:'.format(entry['kind']), (entry.get('name') or entry.get('title') or entry.get('url') or '').encode('ascii', 'ignore'))
+		try:
+			if not retryFailedItem(institution, entry, session):
+				print('\tThis kind of item can not be retried on its own, keeping it on the list.')
+				recordFailure(entry['kind'], entry['error'], **{key: value for key, value in entry.items() if key not in ['kind', 'error']})
+		except Exception:
+			traceback.print_exc()
+			printSkipNotice()
+			recordFailure(entry['kind'], traceback.format_exc(), **{key: value for key, value in entry.items() if key not in ['kind', 'error']})
+
+def dump_courses_or_projects(institution, session, pathThusFar, itemList, itemNameDict, item_type):
+	if use_async_engine:
+		asyncio.run(async_dump_courses_or_projects(institution, session, pathThusFar, itemList, itemNameDict, item_type))
+		return
+
+	if worker_count == 1:
+		for courseIndex in range(len(itemList)):
+			dump_course_or_project(institution, session, pathThusFar, itemList, itemNameDict, item_type, courseIndex)
+		return
+
+	with ThreadPoolExecutor(max_workers=worker_count) as executor:
+		futures = [executor.submit(dump_course_or_project, institution, session, pathThusFar, itemList, itemNameDict, item_type, courseIndex) for courseIndex in range(len(itemList))]
+		try:
+			for future in futures:
+				future.result()
+		except BaseException:
+			# Covers an aborted download; don't start any courses that were still waiting.
+			for future in futures:
+				future.cancel()
+			raise
+
+# --- ASYNCHRONOUS ENGINE ---
+
+# Folder listings and files are fetched by coroutines on a single thread, using aiohttp.
+# Everything else (assignments, tests, discussions, etc.) is built around ASP.NET postbacks of lxml forms, and is still
+# handled by the regular functions in a pool of threads. Bulletins are dumped by those threads as well.
+class AsyncFolderWalker:
+	def __init__(self, institution, session, client, loop, item_executor):
+		self.institution = institution
+		self.session = session
+		self.client = client
+		self.loop = loop
+		self.item_executor = item_executor
+		self.request_semaphore = asyncio.Semaphore(async_max_requests_in_flight)
+
+	# Used as the folder_processor of dump_course_or_project(), which runs on one of the course threads
+	def processFolderFromThread(self, institution, pathThusFar, folderURL, session):
+		asyncio.run_coroutine_threadsafe(self.processFolder(pathThusFar, folderURL), self.loop).result()
+
+	async def waitForToken(self):
+		wait_time = request_bucket.reserve()
+		if wait_time > 0:
+			await asyncio.sleep(wait_time)
+
+	# Without this check, error pages would be read as empty folders, or saved as the downloaded file.
+	@staticmethod
+	def checkStatus(response, url):
+		if response.status < 200 or response.status >= 300:
+			raise UnexpectedStatusError('HTTP {} for {}'.format(response.status, url))
+
+	async def fetchText(self, url):
+		# The token is waited for first, so the semaphore is only held by requests which can be sent right away
+		await self.waitForToken()
+		async with self.request_semaphore:
+			async with self.client.get(url) as response:
+				self.checkStatus(response, url)
+				return await response.text()
+
+	async def reportCrash(self, pathThusFar, item_url, item_name, item_fingerprint):
+		error_information = traceback.format_exc()
+		await self.loop.run_in_executor(self.item_executor, reportFolderItemCrash, self.institution, pathThusFar, item_url, item_name, item_fingerprint, error_information)
+
+	async def processFolder(self, pathThusFar, folderURL):
+		if isCompleted('folder', folderURL):
+			print('\tSkipping folder to resume from saved state:', pathThusFar.encode('ascii', 'ignore'))
+			return
+
+		print("\tDumping folder: ", pathThusFar.encode('ascii', 'ignore'))
+		pathThusFar = sanitisePath(pathThusFar)
+		if not os.path.exists(pathThusFar):
+			pathThusFar = makeDirectories(pathThusFar)
+
+		folder_items = parseFolderListing(parseDocument(await self.fetchText(folderURL)))
+		if len(folder_items) == 0:
+			print('\tFolder is empty.')
+
+		item_tasks = []
+		for item_name, item_url, item_fingerprint in folder_items:
+			if shouldSkipFolderItem(item_url, item_name, item_fingerprint):
+				continue
+			item_tasks.append(self.processFolderItem(pathThusFar, item_url, item_name, item_fingerprint))
+		await asyncio.gather(*item_tasks)
+
+		markCompleted('folder', folderURL)
+
+	async def processFolderItem(self, pathThusFar, item_url, item_name, item_fingerprint):
+		if item_url.startswith('/Folder') or item_url.startswith('/File'):
+			try:
+				if item_url.startswith('/Folder'):
+					await self.processFolder(pathThusFar + "/Folder - " + item_name, itslearning_folder_base_url[self.institution] + item_url.split('=')[1])
+				else:
+					await self.processFile(pathThusFar, itslearning_file_base_url[self.institution] + item_url.split('=')[1])
+					recordItem('element', item_url, item_fingerprint)
+					markCompleted('element', item_url)
+			except Exception:
+				await self.reportCrash(pathThusFar, item_url, item_name, item_fingerprint)
+		else:
+			await self.loop.run_in_executor(self.item_executor, dumpFolderItemOnThread, self.institution, pathThusFar, item_url, item_name, item_fingerprint, self.session)
+
+	async def processFile(self, pathThusFar, fileURL):
+		file_page_text = await self.fetchText(fileURL)
+
+		download_links = re.findall(r'/file/download\.aspx\?FileID=[^"]*', file_page_text)
+		if len(download_links) > 1:
+			print('\tMultiple versions of file were found on page.')
+
+		download_tasks = []
+		for index, file_link in enumerate(download_links):
+			file_id = file_link.split('FileID=')[1].split('&')[0]
+			if isItemUnchanged('file', file_id):
+				print('\tFile was downloaded previously, skipping.')
+				continue
+			download_tasks.append(self.downloadFile(itslearning_root_url[self.institution] + file_link, pathThusFar, file_id, index if len(download_links) > 1 else None))
+		await asyncio.gather(*download_tasks)
+
+	async def downloadFile(self, url, destination_directory, file_id, index):
+		# Unlike download_file(), interrupted downloads are started over, rather than resumed.
+		partial_directory = os.path.join(output_folder_name, partial_downloads_directory_name)
+		os.makedirs(partial_directory, exist_ok=True)
+		part_descriptor, part_path = tempfile.mkstemp(dir=partial_directory, suffix='.part')
+		content_hash = hashlib.sha256() if deduplicate_files else None
+		try:
+			with os.fdopen(part_descriptor, 'wb') as part_file:
+				await self.waitForToken()
+				async with self.request_semaphore:
+					async with self.client.get(url) as response:
+						self.checkStatus(response, url)
+						async for chunk in response.content.iter_chunked(download_chunk_size):
+							part_file.write(chunk)
+							if content_hash is not None:
+								content_hash.update(chunk)
+						filename = downloadFilename(response.headers, url, None, index, False)
+		except BaseException:
+			os.remove(part_path)
+			raise
+
+		print('\tDownloaded', filename.encode('ascii', 'ignore'))
+		if not os.path.exists(destination_directory):
+			destination_directory = makeDirectories(destination_directory)
+		finishDownload(part_path, content_hash, os.path.abspath(sanitisePath(destination_directory) + "/" + sanitisePath(filename)))
+		recordItem('file', file_id)
+
+def dumpFolderItemOnThread(institution, pathThusFar, item_url, item_name, item_fingerprint, session):
+	dumpFolderItem(institution, pathThusFar, item_url, item_name, item_fingerprint, thread_session(session))
+
+async def async_dump_courses_or_projects(institution, session, pathThusFar, itemList, itemNameDict, item_type):
+	try:
+		# Only needed for this engine, so it's imported here.
+		import aiohttp
+		from yarl import URL
+	except ImportError as ie:
+		print('')
+		print('!!! Could not import aiohttp.')
+		print('The asyncio engine requires the aiohttp package. Install it using `pip install aiohttp`, or use the default engine.')
+		print('')
+		raise ie
+
+	# The cookies obtained when logging in are handed over, but only for It's Learning itself
+	cookie_jar = aiohttp.CookieJar()
+	cookie_jar.update_cookies({cookie.name: cookie.value for cookie in session.cookies}, URL(itslearning_root_url[institution]))
+
+	loop = asyncio.get_running_loop()
+	connector = aiohttp.TCPConnector(limit=async_max_requests_in_flight)
+	async with aiohttp.ClientSession(cookie_jar=cookie_jar, connector=connector, headers=dict(session.headers)) as client:
+		# Course threads spend most of their time waiting for the folder coroutines, so they get an executor of their own.
+		with ThreadPoolExecutor(max_workers=worker_count) as course_executor, ThreadPoolExecutor(max_workers=worker_count) as item_executor:
+			walker = AsyncFolderWalker(institution, session, client, loop, item_executor)
+			course_tasks = [loop.run_in_executor(course_executor, dump_course_or_project, institution, session, pathThusFar, itemList, itemNameDict, item_type, courseIndex, walker.processFolderFromThread) for courseIndex in range(len(itemList))]
+			await asyncio.gather(*course_tasks)
 
 
 
@@ -2116,30 +3991,91 @@ def dump_courses_or_projects(institution, session, pathThusFar, itemList, itemNa
 
 # --- MAIN PROGRAM ---
 
-catch_up_directions = None
-if os.path.exists(progress_file_location) and not args.do_listing:
-	print('It appears you have run this script previously. Would you like to continue where you left off?')
-	print('Type "continue" to fast-forward to where you left off. Type anything else to start over.')
-	decision = input('Confirm fast-forward: ')
-	if decision == 'continue':
-		print('Loading saved state file.')
-		with open(progress_file_location) as input_file:
-			file_contents = input_file.readlines() 
-		state_course_id = int(file_contents[0])
-		state_folder_state = [int(i) for i in file_contents[1].split(', ')]
-		catch_up_directions = [state_course_id, state_folder_state]
-
-with requests.Session() as session:
+if args.benchmark == 'parse':
+	if args.http_cache_dir is None and args.output_dir is None:
+		print('Please specify where the cached pages are, using --http-cache-dir or --output-dir.')
+		sys.exit(1)
+	benchmarkParsing(args.http_cache_dir if args.http_cache_dir is not None else os.path.join(args.output_dir, '.http-cache'))
+	sys.exit(0)
+
+if args.benchmark == 'sanitise':
+	benchmarkSanitising()
+	sys.exit(0)
+
+# The items which failed last time are read before a new list is started
+failed_items_location = None if args.do_listing else os.path.join(output_folder_name, failed_items_file_name)
+retry_entries = None
+if args.retry_failed and not args.do_listing:
+	if not os.path.exists(failed_items_location):
+		print('There is no list of failed items ({}) in the output directory, so there is nothing to retry.'.format(failed_items_file_name))
+		sys.exit(0)
+	retry_entries = FailedItems.load(failed_items_location)
+	os.replace(failed_items_location, failed_items_location + '.previous')
+	print('Retrying {} failed items.'.format(len(retry_entries)))
+
+if not args.do_listing:
+	failed_items = FailedItems(failed_items_location)
+
+# When retrying, items which were completed before are skipped, so retrying a course or its bulletins doesn't save them a second time.
+# Folders are marked as completed even if some of their items failed, so those are entered again.
+if args.retry_failed and not args.do_listing:
+	checkpoint_file_location = os.path.join(output_folder_name, checkpoint_file_name)
+	if os.path.exists(checkpoint_file_location):
+		checkpoint_journal = CheckpointJournal(checkpoint_file_location, True, read_only=True, ignored_kinds=['folder'])
+
+if not args.do_listing and not args.retry_failed:
+	checkpoint_file_location = os.path.join(output_folder_name, checkpoint_file_name)
+	resume_from_checkpoint = False
+	if os.path.exists(checkpoint_file_location):
+		print('It appears you have run this script previously. Would you like to continue where you left off?')
+		print('Type "continue" to fast-forward to where you left off. Type anything else to start over.')
+		decision = input('Confirm fast-forward: ')
+		resume_from_checkpoint = decision == 'continue'
+		if resume_from_checkpoint:
+			print('Loading saved state file.')
+		else:
+			# The directory was only accepted because of the journal, so starting over needs it to be empty otherwise
+			os.remove(checkpoint_file_location)
+			if not args.incremental and os.listdir(output_folder_name):
+				print('To start over, the output directory needs to be empty. Please empty it or choose another one, and run the script again.')
+				sys.exit(1)
+	if enable_checkpoints or resume_from_checkpoint:
+		checkpoint_journal = CheckpointJournal(checkpoint_file_location, resume_from_checkpoint)
+		atexit.register(checkpoint_journal.close)
+
+if args.incremental and not args.do_listing:
+	manifest = Manifest(os.path.join(output_folder_name, manifest_file_name))
+	atexit.register(manifest.close)
+
+if (args.http_cache or offline_mode) and not args.do_listing:
+	http_cache = HTTPCache(args.http_cache_dir if args.http_cache_dir is not None else os.path.join(output_folder_name, '.http-cache'))
+
+if args.pack_output is not None and not args.do_listing:
+	packed_output = PackedOutput(output_folder_name, args.pack_output)
+	atexit.register(packed_output.close)
+
+if args.export is not None and not args.do_listing:
+	export_sink = ExportSink(os.path.join(output_folder_name, export_file_name + '.' + args.export), args.export)
+	atexit.register(export_sink.close)
+
+if write_queue_size > 0 and not args.do_listing:
+	output_writer = OutputWriter(write_queue_size, write_batch_size)
+	atexit.register(output_writer.close)
+
+transport_adapter = createTransportAdapter()
+
+with DumperSession() as session:
 	response = session.get(innsida, allow_redirects=True)
 
 	session.get(platform_redirection, allow_redirects=True)
 
-	login_page = fromstring(response.text)
+	login_page = parseDocument(response.text, postback=True)
 
 	login_form = login_page.forms[0]
 
-	credentials_correct = False
-	if args.username is None:
+	# There's no need to log in when replaying a previous session
+	credentials_correct = offline_mode
+	if args.username is None and not offline_mode:
 		print()
 		print('----------')
 		print('To continue, the script needs your HKR login credentials.')
@@ -2170,8 +4106,8 @@ with requests.Session() as session:
 		login_form_dict['ctl00$ContentPlaceHolder1$nativeLoginButton'] = "Logga in"
 
 		print('Sending login data')
-		relay_response = session.post(itslearning_root_url['hkr'], data=login_form_dict, allow_redirects=True)
-		if not fromstring(relay_response.text).forms[0].action.startswith('./DashboardMenu.aspx'):
+		relay_response = session.post(itslearning_root_url['hkr'], data=login_form_dict, allow_redirects=True, cache=False)
+		if not parseDocument(relay_response.text, postback=True).forms[0].action.startswith('./DashboardMenu.aspx'):
 			print('Incorrect credentials!')
 		else:
 			credentials_correct = True
@@ -2182,6 +4118,10 @@ with requests.Session() as session:
 		print('Access detected successfully.')
 		print('Accessing It\'s Learning')
 
+		if retry_entries is not None:
+			retryFailedItems(institution, session, retry_entries)
+			continue
+
 		print('Listing courses.')
 
 		# Part 1: Obtain session-specific form
@@ -2213,8 +4153,9 @@ with requests.Session() as session:
 		pathThusFar = output_folder_name
 
 		# If it is desirable to skip to a particular course, also skip downloading the messages again
-		if skip_to_course_with_index == 0 and catch_up_directions is None and not args.courses_only and not args.projects_only:
+		if skip_to_course_with_index == 0 and not isCompleted('messaging', institution) and not args.courses_only and not args.projects_only:
 			processMessaging(institution, pathThusFar, session)
+			markCompleted('messaging', institution)
 
 		if not args.messaging_only and not args.courses_only:
 			print('Dumping Projects')
@@ -2227,7 +4168,13 @@ with requests.Session() as session:
 
 
 		print('All content from the institution site was downloaded successfully!')
-	print('Done. Everything was downloaded successfully!')
+	if output_writer is not None:
+		output_writer.close()
+	if failed_items is not None and failed_items.count > 0:
+		print('Done, but {} items could not be downloaded. They are listed in {}.'.format(failed_items.count, failed_items.path.encode('ascii', 'ignore')))
+		print('Run the script again with --retry-failed and the same output directory to try them once more.')
+	else:
+		print('Done. Everything was downloaded successfully!')
 	input('Press Enter to exit.')
 
 